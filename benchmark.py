@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+
+"""
+Benchmark suite for the log processor.
+
+Generates synthetic logs shaped like `sample/1.in`, times a set of command
+pipelines through both `main.py` and `log-interact-in-one.py`, and writes the
+results to a JSON file that can be compared with earlier runs.
+"""
+
+import argparse as _argparse
+import datetime as _datetime
+import json as _json
+import os as _os
+import platform as _platform
+import random as _random
+import subprocess as _subprocess
+import sys as _sys
+import time as _time
+
+__author__ = 'Michael'
+
+ROOT = _os.path.dirname(_os.path.abspath(__file__))
+
+PROGRAMS = {
+    "main": _os.path.join(ROOT, "main.py"),
+    "in-one": _os.path.join(ROOT, "log-interact-in-one.py"),
+}
+
+_DICT = "read-by-line && split ^ && make-dict = && int a"
+
+# `read-lines` turns into `read-by-line` for large files, so `do` is chained with `;`
+OPERATIONS = [
+    ("read-lines", "read-lines ; do"),
+    ("read-by-line", "read-by-line && do"),
+    ("split", "read-by-line && split ^ && do"),
+    ("make-dict", "read-by-line && split ^ && make-dict = && do"),
+    ("keep-regex", "read-by-line && keep ip=1[0-9]\\. && do"),
+    ("keep-expression", _DICT + " && keep a > 50 && do"),
+    ("group", _DICT + " && group @ ip"),
+    ("sum", _DICT + " && sum a @ ip"),
+    ("sort", _DICT + " && do && sort @ a - id +"),
+]
+
+# `read-lines` returns a `List` for files smaller than this, which `do` cannot execute on
+BY_LINE_THRESHOLD = 1024 * 1024
+SMALL_FILE_PIPELINES = {
+    "read-lines": "read-lines",
+}
+
+SIZES = {
+    "10MB": 10 * 1024 * 1024,
+    "100MB": 100 * 1024 * 1024,
+    "1GB": 1024 * 1024 * 1024,
+}
+
+
+def parse_size(text):
+    if text in SIZES:
+        return SIZES[text]
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def generate(name, size, ips=1000, values=100, seed=0):
+    """
+    Write a log file of roughly `size` bytes.
+
+    :param ips: Number of distinct values of `ip`
+    :param values: Number of distinct values of `a`
+    """
+    rng = _random.Random(seed)
+    ip_pool = ["{}.{}.{}.{}".format(*[rng.randint(1, 254) for _ in range(4)])
+               for _ in range(ips)]
+    start = _datetime.datetime(2016, 12, 31)
+    written = 0
+    i = 0
+    with open(name, "w") as f:
+        while written < size:
+            lines = []
+            for _ in range(10000):
+                i += 1
+                lines.append("id={}^ip={}^time={}^a={}\n".format(
+                    i,
+                    rng.choice(ip_pool),
+                    (start + _datetime.timedelta(seconds=i // 10)).strftime("%Y%m%d%H%M%S"),
+                    rng.randint(1, values)
+                ))
+            chunk = "".join(lines)
+            f.write(chunk)
+            written += len(chunk)
+    return i
+
+
+def time_script(program, script, repeat):
+    """
+    Run a script through a program `repeat` times.
+
+    :return: Wall time of each run, and whether any error was printed
+    """
+    seconds = []
+    errors = False
+    for _ in range(repeat):
+        start = _time.perf_counter()
+        proc = _subprocess.run(
+            [_sys.executable, program, script],
+            stdout=_subprocess.PIPE,
+            stderr=_subprocess.STDOUT,
+        )
+        seconds.append(_time.perf_counter() - start)
+        if proc.returncode != 0 or b"31m" in proc.stdout:
+            errors = True
+    return seconds, errors
+
+
+def git_revision():
+    try:
+        return _subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=_subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, _subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    if not _os.path.isdir(args.data):
+        _os.makedirs(args.data)
+
+    operations = [op for op in OPERATIONS if not args.ops or op[0] in args.ops]
+    programs = [p for p in sorted(PROGRAMS) if not args.programs or p in args.programs]
+
+    results = []
+    for size_name in args.sizes:
+        size = parse_size(size_name)
+        log = _os.path.join(args.data, "bench-{}-{}ip-{}values.in".format(size_name, args.ips, args.values))
+        if not _os.path.exists(log):
+            print("Generating {} ...".format(log))
+            generate(log, size, ips=args.ips, values=args.values)
+        script = _os.path.join(args.data, "bench.script")
+        for op, pipeline in operations:
+            if _os.path.getsize(log) < BY_LINE_THRESHOLD:
+                pipeline = SMALL_FILE_PIPELINES.get(op, pipeline)
+            with open(script, "w") as f:
+                f.write("open {} && {}\n".format(log, pipeline))
+            for program in programs:
+                seconds, errors = time_script(PROGRAMS[program], script, args.repeat)
+                results.append({
+                    "size": size_name,
+                    "bytes": _os.path.getsize(log),
+                    "program": program,
+                    "operation": op,
+                    "pipeline": pipeline,
+                    "seconds": seconds,
+                    "best": min(seconds),
+                    "errors": errors,
+                })
+                print("{:>6}  {:<7}  {:<16} {:8.3f}s{}".format(
+                    size_name, program, op, min(seconds), "  (errors)" if errors else ""))
+
+    with open(args.output, "w") as f:
+        _json.dump({
+            "time": _datetime.datetime.now().isoformat(),
+            "revision": git_revision(),
+            "python": _platform.python_version(),
+            "platform": _platform.platform(),
+            "ips": args.ips,
+            "values": args.values,
+            "results": results,
+        }, f, indent=2)
+    print("Results written to {}".format(args.output))
+
+
+def compare(args):
+    def __load(name):
+        with open(name) as f:
+            data = _json.load(f)
+        return {(r["size"], r["program"], r["operation"]): r["best"] for r in data["results"]}
+
+    old, new = __load(args.old), __load(args.new)
+    for key in sorted(set(old) & set(new)):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print("{:>6}  {:<7}  {:<16} {:8.3f}s -> {:8.3f}s  {:+6.1f}%{}".format(
+            key[0], key[1], key[2], old[key], new[key], change,
+            "  REGRESSION" if change > args.threshold else ""))
+
+
+def main():
+    parser = _argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="action")
+
+    p = sub.add_parser("generate", help="generate a synthetic log file")
+    p.add_argument("file")
+    p.add_argument("size", help="e.g. 10MB, 100MB, 1GB or a number of bytes")
+    p.add_argument("--ips", type=int, default=1000, help="number of distinct ips")
+    p.add_argument("--values", type=int, default=100, help="number of distinct values of `a`")
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser("run", help="run the benchmarks")
+    p.add_argument("--sizes", nargs="+", default=["10MB"], help="e.g. 10MB 100MB 1GB")
+    p.add_argument("--ips", type=int, default=1000, help="number of distinct ips")
+    p.add_argument("--values", type=int, default=100, help="number of distinct values of `a`")
+    p.add_argument("--ops", nargs="+", help="only run these operations")
+    p.add_argument("--programs", nargs="+", choices=sorted(PROGRAMS))
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--data", default=_os.path.join(ROOT, "benchmark-data"),
+                   help="directory for generated logs")
+    p.add_argument("--output", default="benchmark.json")
+
+    p = sub.add_parser("compare", help="compare two result files")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=10.0,
+                   help="percentage of slowdown reported as regression")
+
+    args = parser.parse_args()
+    if args.action == "generate":
+        lines = generate(args.file, parse_size(args.size),
+                         ips=args.ips, values=args.values, seed=args.seed)
+        print("{} lines written to {}".format(lines, args.file))
+    elif args.action == "run":
+        run(args)
+    elif args.action == "compare":
+        compare(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
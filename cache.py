@@ -0,0 +1,97 @@
+import collections as _collections
+import os as _os
+
+__author__ = 'Michael'
+
+# Commands whose result only depends on the previous result and the argument
+DETERMINISTIC = {
+    "read-lines", "read-by-line", "read-format", "read-bytes", "decode", "do",
+    "split", "parse", "make-dict", "keep", "throw", "take", "int", "number",
+    "add-before", "add-after", "replace", "rename", "bucket", "limit",
+    "group", "un-group", "sort", "count", "add-count", "sum", "count-distinct",
+    "dedup", "dedup-bloom", "infer-types",
+}
+
+# Commands that leave the data of the result unchanged
+PASS_THROUGH = {"print", "save", "store", "-", "profile", "progress", "cache", "mem", "tee"}
+
+
+def file_identity(name):
+    """
+    :return: (path, size, mtime) of a file, or None if it cannot be accessed
+    """
+    try:
+        path = _os.path.abspath(name)
+        stat = _os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def next_lineage(lineage, cmd, arg):
+    """
+    The lineage of the result of a command, given the lineage of its input.
+
+    A lineage is a tuple of the identity of the opened file and every command
+    executed on it since, or None if the result cannot be reproduced that way.
+    """
+    if cmd == "open":
+        if not arg:
+            return None
+        identity = file_identity(arg.strip())
+        if identity is None:
+            return None
+        return identity,
+    if cmd in PASS_THROUGH:
+        return lineage
+    if lineage is None or cmd not in DETERMINISTIC:
+        return None
+    arg = arg.strip() if arg else ""
+    return lineage + ((cmd + " " + arg).strip(),)
+
+
+class ResultCache(object):
+    """
+    Results (`List`s) of command prefixes, evicted least recently used first
+    when their total estimated size exceeds `capacity` bytes.
+    """
+    DEFAULT_CAPACITY = 256 * 1024 * 1024
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.size = 0
+        self.hits = 0
+        self.__entries = _collections.OrderedDict()
+
+    def __repr__(self):
+        return "ResultCache({} entries, {:.1f}/{:.1f} MB, {} hits)".format(
+            len(self.__entries), self.size / 1024 / 1024, self.capacity / 1024 / 1024, self.hits)
+
+    def __contains__(self, lineage):
+        return lineage in self.__entries
+
+    def get(self, lineage):
+        if lineage not in self.__entries:
+            return None
+        self.hits += 1
+        self.__entries.move_to_end(lineage)
+        return self.__entries[lineage][0]
+
+    def put(self, lineage, value, size):
+        if lineage in self.__entries:
+            self.size -= self.__entries.pop(lineage)[1]
+        if size > self.capacity:
+            return
+        self.__entries[lineage] = (value, size)
+        self.size += size
+        self.resize(self.capacity)
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        while self.size > self.capacity:
+            value, size = self.__entries.popitem(last=False)[1]
+            self.size -= size
+
+    def clear(self):
+        self.__entries.clear()
+        self.size = 0
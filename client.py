@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+import socket as _socket
+import sys as _sys
+
+__author__ = 'Michael'
+
+END = "\0"
+
+
+def connect(path, script=None):
+    """
+    Send command lines to a program started with `--serve`, and print its output.
+
+    Lines are read from `script` if given, or else from the user.
+    """
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    sock.connect(path)
+    f = sock.makefile("rw", encoding="utf-8", newline="\n")
+
+    def __send(line):
+        """
+
+        :return: False if the server closed the connection
+        """
+        f.write(line.rstrip("\n") + "\n")
+        f.flush()
+        for reply in f:
+            if reply.endswith(END + "\n"):
+                _sys.stdout.write(reply[:-len(END) - 1])
+                _sys.stdout.flush()
+                return True
+            _sys.stdout.write(reply)
+        return False
+
+    try:
+        if script is not None:
+            with open(script) as lines:
+                for line in lines:
+                    if not __send(line):
+                        break
+        else:
+            while True:
+                try:
+                    line = input("> ")
+                except EOFError:
+                    break
+                if not __send(line):
+                    break
+    finally:
+        f.close()
+        sock.close()
+
+
+if __name__ == "__main__":
+    if len(_sys.argv) not in [2, 3]:
+        print("Usage: {} SOCKET [SCRIPT]".format(_sys.argv[0]))
+    else:
+        connect(*_sys.argv[1:])
@@ -14,10 +14,19 @@ def command(name):
     return __decor
 
 
-def execute(name, **kwargs):
-    if name not in __commands:
-        raise _util.Error("Command '{}' not found".format(name))
-    return __commands[name](cmd=name, **kwargs)
+def get(name):
+    """
+    Get the function of a command, or None if not found.
+    """
+    return __commands.get(name)
+
+
+def execute(name, func=None, **kwargs):
+    if func is None:
+        if name not in __commands:
+            raise _util.Error("Command '{}' not found".format(name))
+        func = __commands[name]
+    return func(cmd=name, **kwargs)
 
 
 # -----
@@ -51,9 +60,7 @@ def __cmd_run(arg, error, console, **kwargs):
     if not arg:
         error("Please specify a script")
     try:
-        with open(arg) as f:
-            for line in f:
-                console.line(line)
+        console.run(arg)
     except FileNotFoundError:
         error("File '{}' does not exist".format(arg))
     except IsADirectoryError:
@@ -62,6 +69,73 @@ def __cmd_run(arg, error, console, **kwargs):
         return console.result
 
 
+@command("profile")
+def __cmd_profile(arg, error, last, console, **kwargs):
+    if arg == "on":
+        console.profile(True)
+    elif arg == "off":
+        console.profile(False)
+    else:
+        error("Please specify 'on' or 'off'")
+    return last
+
+
+@command("progress")
+def __cmd_progress(arg, error, last, console, **kwargs):
+    if arg == "on":
+        console.show_progress = True
+    elif arg == "off":
+        console.show_progress = False
+    else:
+        error("Please specify 'on' or 'off'")
+    return last
+
+
+@command("cache")
+def __cmd_cache(arg, last, console, **kwargs):
+    console.set_cache(arg)
+    return last
+
+
+MEM_SAMPLE = 10000
+
+
+@command("mem")
+def __cmd_mem(arg, error, last, console, **kwargs):
+    if arg:
+        try:
+            threshold = int(arg)
+        except ValueError:
+            error("Invalid argument")
+        if threshold < 0:
+            error("Invalid argument")
+        _log.STRINGS.threshold = threshold
+
+    def __report(name, value):
+        if isinstance(value, _log.List) and len(value):
+            size, pooled = value.memory(MEM_SAMPLE)
+            console.output("{}: {!r}  {:.1f} bytes/row  {} of strings pooled".format(
+                name, value, size / len(value), "-" if pooled is None else "{:.1%}".format(pooled)))
+        else:
+            console.output("{}: {!r}".format(name, value))
+
+    __report("(result)", last)
+    for name in sorted(console.stored_values):
+        __report(name, console.stored_values[name])
+    console.output(repr(_log.STRINGS))
+    return last
+
+
+@command("parallel")
+def __cmd_parallel(arg, console, **kwargs):
+    return console.parallel(arg)
+
+
+@command("tee")
+def __cmd_tee(arg, console, **kwargs):
+    return console.tee(arg)
+
+
 @command("-")
 def __cmd_sep(last, console, **kwargs):
     console.output("")
@@ -71,7 +145,11 @@ def __cmd_sep(last, console, **kwargs):
 @command("close")
 @command("read-lines")
 @command("read-by-line")
+@command("read-format")
+@command("read-bytes")
+@command("decode")
 @command("split")
+@command("parse")
 @command("make-dict")
 @command("print")
 @command("save")
@@ -93,7 +171,16 @@ def __cmd_sep(last, console, **kwargs):
 @command("count")
 @command("add-count")
 @command("sum")
+@command("count-distinct")
+@command("join")
+@command("left-join")
+@command("dedup")
+@command("dedup-bloom")
+@command("sample")
+@command("sample-rate")
 @command("rename")
+@command("bucket")
+@command("infer-types")
 def __cmd_common(last, error, **kwargs):
     if last is None:
         error("Nothing to operate")
@@ -103,6 +190,9 @@ def __cmd_common(last, error, **kwargs):
 @command("load")
 def __cmd_load(arg, error, console, **kwargs):
     if arg in console.stored_values:
-        return console.stored_values[arg]
+        value = console.stored_values[arg]
+        if isinstance(value, _log.Cache):
+            return value.load(arg, error)
+        return value
     else:
         error("Value '{}' not found".format(arg))
@@ -1,8 +1,31 @@
 #!/usr/bin/python3
 
+import asyncio
+import codecs
+import collections
+import datetime
+import hashlib
+import io
+import json
+import math
+import multiprocessing
 import os
 import platform
+import queue
+import random
 import re
+import shutil
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 __author__ = 'Michael'
 
@@ -124,52 +147,6 @@ class SequenceDict(object):
         return list(__gen())
 
 
-class SortedDict(object):
-    def __init__(self, order=None):
-        """
-
-        :param reversed:
-            None (default): not sorted
-            "+": ascending
-            "-": descending
-        """
-        self.__keys = []
-        self.__dict = {}
-        self.__order = order
-
-    def __getitem__(self, key):
-        return self.__dict[key]
-
-    def __contains__(self, item):
-        return item in self.__keys
-
-    def __iter__(self):
-        return self.__keys.__iter__()
-
-    def __len__(self):
-        return len(self.__keys)
-
-    def __setitem__(self, key, value):
-        if key not in self.__keys:
-            if self.__order == "+":
-                for i in range(len(self.__keys)):
-                    if self.__keys[i] > key:
-                        self.__keys.insert(i, key)
-                        break
-                else:
-                    self.__keys.append(key)
-            elif self.__order == "-":
-                for i in range(len(self.__keys)):
-                    if self.__keys[i] < key:
-                        self.__keys.insert(i, key)
-                        break
-                else:
-                    self.__keys.append(key)
-            else:
-                self.__keys.append(key)
-        self.__dict[key] = value
-
-
 def resolve_group_args(*args):
     i = None
     for arg in args:
@@ -186,12 +163,374 @@ def resolve_group_args(*args):
         yield i, None
 
 
+def sort_group_keys(keys, orders):
+    """
+    Order composite group keys the same way nested groups would.
+
+    :param keys: Tuples of values, in the order they were first seen
+    :param orders: "+", "-" or None for each position of the tuples
+    """
+    keys = list(keys)
+    seen = {}
+    for key in keys:
+        for i in range(1, len(key) + 1):
+            seen.setdefault(key[:i], len(seen))
+    for i in reversed(range(len(orders))):
+        if orders[i] is None:
+            keys.sort(key=lambda k: seen[k[:i + 1]])
+        else:
+            keys.sort(key=lambda k: k[i], reverse=orders[i] == "-")
+    return keys
+
+
+def sizeof(value, seen=None, strings=None):
+    """
+    Approximate number of bytes used by a value, including the values it contains.
+
+    :param seen: A set of ids of objects already counted, so that shared objects are counted once
+    :param strings: A list that every string found is appended to
+    """
+    if strings is not None and isinstance(value, str):
+        strings.append(value)
+    if seen is not None:
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float)) or value is None:
+        return size
+    if isinstance(value, (list, tuple, set)):
+        return size + sum(sizeof(v, seen, strings) for v in value)
+    if hasattr(value, "__getitem__"):
+        # Mappings, including SequenceDict, which keeps its keys in a list and a dict
+        keys = list(value)
+        return size + sys.getsizeof(keys) + sys.getsizeof(dict.fromkeys(keys)) + \
+            sum(sizeof(k, seen, strings) + sizeof(value[k], seen, strings) for k in keys)
+    return size
+
+
+class StringPool(object):
+    """
+    Shares equal strings between entries, so that each of them is kept in memory once.
+
+    The first `MAX_KEYS` distinct keys are pooled. Values are pooled separately for each
+    of those keys, until the key has `threshold` distinct values; after that, only those
+    values are shared.
+    """
+    DEFAULT_THRESHOLD = 1024
+    MAX_KEYS = 4096
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.hits = 0
+        self.lookups = 0
+        self.__keys = {}
+        self.__values = {}
+        self.__ids = set()
+
+    def __repr__(self):
+        return "StringPool({} keys, {} values, threshold {}, value hit rate {})".format(
+            len(self.__keys), sum(len(pool) for pool in self.__values.values()), self.threshold,
+            "{:.1%}".format(self.hits / self.lookups) if self.lookups else "-")
+
+    def key(self, s):
+        pooled = self.__keys.get(s)
+        if pooled is None:
+            if len(self.__keys) >= StringPool.MAX_KEYS:
+                return s
+            pooled = self.__keys[s] = s
+            self.__ids.add(id(s))
+        return pooled
+
+    def value(self, key, s):
+        if type(s) is not str or not self.threshold:
+            return s
+        pool = self.__values.get(key)
+        if pool is None:
+            if len(self.__values) >= StringPool.MAX_KEYS:
+                return s
+            pool = self.__values[key] = {}
+        self.lookups += 1
+        pooled = pool.get(s)
+        if pooled is not None:
+            self.hits += 1
+            return pooled
+        if len(pool) < self.threshold:
+            pool[s] = s
+            self.__ids.add(id(s))
+        return s
+
+    def pooled(self, s):
+        return id(s) in self.__ids
+
+    def clear(self):
+        """
+        Forget all pooled strings, so that they can be freed with the entries that use them.
+        """
+        self.hits = 0
+        self.lookups = 0
+        self.__keys.clear()
+        self.__values.clear()
+        self.__ids.clear()
+
+
+def infer_type(values):
+    """
+    The narrowest of `int` and `float` that all strings in `values` can be converted to.
+
+    :return: None if some string cannot be converted, or if there are no strings
+    """
+    result = None
+    for v in values:
+        if not isinstance(v, str):
+            continue
+        if result in [None, int]:
+            try:
+                int(v)
+                result = int
+                continue
+            except ValueError:
+                pass
+        try:
+            float(v)
+            result = float
+        except ValueError:
+            return None
+    return result
+
+
+def digest(value):
+    """
+    A 16-byte digest of `str(value)`.
+    """
+    return hashlib.md5(str(value).encode()).digest()
+
+
+def hash64(value):
+    return int.from_bytes(digest(value)[:8], "big")
+
+
+class HyperLogLog(object):
+    def __init__(self, precision=12):
+        """
+
+        :param precision: 4 to 16; uses 2 ** precision bytes
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError
+        self.__p = precision
+        self.__m = 1 << precision
+        self.__registers = bytearray(self.__m)
+
+    def add(self, value):
+        x = hash64(value)
+        bits = 64 - self.__p
+        j = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.__registers[j]:
+            self.__registers[j] = rank
+
+    def merge(self, other):
+        if other.__p != self.__p:
+            raise ValueError
+        self.__registers = bytearray(map(max, self.__registers, other.__registers))
+
+    def estimate(self):
+        m = self.__m
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        e = alpha * m * m / sum(2.0 ** -r for r in self.__registers)
+        zeros = self.__registers.count(0)
+        if e <= 2.5 * m and zeros:
+            e = m * math.log(m / zeros)
+        return int(round(e))
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, rate=0.01):
+        """
+
+        :param capacity: The number of values expected
+        :param rate: The false positive rate when `capacity` values are added
+        """
+        if capacity <= 0 or not 0 < rate < 1:
+            raise ValueError
+        self.__m = int(math.ceil(-capacity * math.log(rate) / math.log(2) ** 2))
+        self.__k = max(1, int(round(self.__m / capacity * math.log(2))))
+        self.__bits = bytearray((self.__m + 7) // 8)
+
+    def __len__(self):
+        return len(self.__bits)
+
+    def add(self, digest):
+        """
+        Add a 16-byte digest (see `digest`).
+
+        :return: True if the digest was (probably) added before
+        """
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        found = True
+        for i in range(self.__k):
+            j = (h1 + i * h2) % self.__m
+            byte, bit = j >> 3, 1 << (j & 7)
+            if not self.__bits[byte] & bit:
+                found = False
+                self.__bits[byte] |= bit
+        return found
+
+
+def parse_duration(text):
+    """
+    Parse a duration such as "30s", "5m", "1h" or "1d" into seconds.
+
+    A number without a unit is in seconds.
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text and text[-1] in units:
+        return int(text[:-1]) * units[text[-1]]
+    return int(text)
+
+
+class TimeBuckets(object):
+    """
+    Round timestamps in a `strptime` format down to buckets of `width` seconds.
+
+    If the format ends with seconds ("%S"), timestamps are parsed without the seconds,
+    so that all timestamps in the same minute share one parse. Parsed timestamps and
+    formatted buckets are cached.
+    """
+    CACHE_SIZE = 65536
+    EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self, fmt, width):
+        if width <= 0:
+            raise ValueError
+        self.__fmt = fmt
+        self.__width = width
+        self.__by_minute = fmt.endswith("%S")
+        self.__parsed = {}
+        self.__buckets = {}
+
+    def __parse(self, text, fmt):
+        if text not in self.__parsed:
+            if len(self.__parsed) >= TimeBuckets.CACHE_SIZE:
+                self.__parsed.clear()
+            dt = datetime.datetime.strptime(text, fmt)
+            self.__parsed[text] = int((dt - TimeBuckets.EPOCH).total_seconds())
+        return self.__parsed[text]
+
+    def __call__(self, value):
+        value = str(value)
+        if self.__by_minute and value[-2:].isdigit():
+            t = self.__parse(value[:-2], self.__fmt[:-2]) + int(value[-2:])
+        else:
+            t = self.__parse(value, self.__fmt)
+        start = t - t % self.__width
+        if start not in self.__buckets:
+            if len(self.__buckets) >= TimeBuckets.CACHE_SIZE:
+                self.__buckets.clear()
+            dt = TimeBuckets.EPOCH + datetime.timedelta(seconds=start)
+            self.__buckets[start] = dt.strftime(self.__fmt)
+        return self.__buckets[start]
+
+
+class Progress(object):
+    """
+    A progress line of reading `size` bytes, redrawn on `file` at most once every `interval` seconds.
+    """
+
+    def __init__(self, size, file=None, interval=0.5):
+        self.__size = size
+        self.__file = file if file is not None else sys.stderr
+        self.__interval = interval
+        self.__start = self.__last = time.perf_counter()
+        self.__shown = False
+
+    def update(self, done, rows):
+        """
+        Redraw the line if `interval` has passed since it was last drawn.
+
+        :param done: Bytes read so far
+        :param rows: Rows read so far
+        """
+        now = time.perf_counter()
+        if now - self.__last < self.__interval:
+            return
+        self.__last = now
+        elapsed = now - self.__start
+        done = min(done, self.__size)
+        rate = done / elapsed
+        if rate > 0:
+            eta = str(datetime.timedelta(seconds=int((self.__size - done) / rate)))
+        else:
+            eta = "-"
+        self.__file.write("\r{:5.1f}%  {:.1f} MB/s  {:.0f} rows/s  ETA {}\033[K".format(
+            done / self.__size * 100 if self.__size else 100.0,
+            rate / 1024 / 1024,
+            rows / elapsed,
+            eta
+        ))
+        self.__file.flush()
+        self.__shown = True
+
+    def clear(self):
+        """
+        Erase the line, if it has been drawn.
+        """
+        if self.__shown:
+            self.__file.write("\r\033[K")
+            self.__file.flush()
+            self.__shown = False
+
+
+class Interrupt(object):
+    """
+    Within a `with` block, turn Ctrl-C into a request to stop, which readers check between rows.
+
+    Pressing Ctrl-C again before the request is handled raises `KeyboardInterrupt` as usual.
+    Ctrl-C is left alone outside the main thread.
+    """
+
+    def __init__(self):
+        self.requested = False
+        self.rows = None
+        self.__previous = None
+
+    def __handle(self, signum, frame):
+        if self.requested:
+            raise KeyboardInterrupt
+        self.requested = True
+
+    def __enter__(self):
+        self.requested = False
+        self.rows = None
+        if threading.current_thread() is threading.main_thread():
+            self.__previous = signal.signal(signal.SIGINT, self.__handle)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.__previous is not None:
+            signal.signal(signal.SIGINT, self.__previous)
+            self.__previous = None
+
+
 # --- log.py ---
 
 class HandlerMethodNotFound(Error):
     pass
 
 
+# Strings shared by entries read from files
+STRINGS = StringPool()
+
+
 class Handler(object):
     @classmethod
     def get_handler_method(cls, cmd):
@@ -208,20 +547,145 @@ class Handler(object):
         return self.__class__.__name__
 
 
+class ReadAhead(object):
+    """
+    Read a file in blocks in a background thread, and split the blocks into lines.
+
+    At most `depth` blocks are read ahead of the lines consumed.
+    """
+
+    def __init__(self, file, depth, block):
+        self.depth = depth
+        self.block = block
+        self.blocks = 0
+        self.max_queued = 0
+        self.waits = 0
+        self.__file = file
+        self.__queue = queue.Queue(depth)
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__read)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __repr__(self):
+        return "read-ahead depth={} block={} blocks={} max-queued={} waits={}".format(
+            self.depth, self.block, self.blocks, self.max_queued, self.waits)
+
+    def __put(self, data):
+        while not self.__stop.is_set():
+            try:
+                self.__queue.put(data, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __read(self):
+        try:
+            while True:
+                data = self.__file.read(self.block)
+                if not self.__put(data) or not data:
+                    return
+        except Exception as e:
+            self.__put(e)
+
+    def __iter__(self):
+        rest = ""
+        while True:
+            if self.__queue.empty():
+                self.waits += 1
+            data = self.__queue.get()
+            self.max_queued = max(self.max_queued, self.__queue.qsize() + 1)
+            if isinstance(data, Exception):
+                raise data
+            if not data:
+                break
+            self.blocks += 1
+            lines = (rest + data).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line
+        if rest:
+            yield rest
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+
+class ByteRange(io.RawIOBase):
+    """
+    The bytes of a file from `start` to `stop`.
+    """
+
+    def __init__(self, name, start, stop):
+        io.RawIOBase.__init__(self)
+        self.__file = open(name, "rb", buffering=0)
+        self.__file.seek(start)
+        self.__start = start
+        self.__left = stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.__left)
+        if n <= 0:
+            return 0
+        data = self.__file.read(n)
+        b[:len(data)] = data
+        self.__left -= len(data)
+        return len(data)
+
+    def tell(self):
+        return self.__file.tell() - self.__start
+
+    def close(self):
+        self.__file.close()
+        io.RawIOBase.close(self)
+
+
 class OpenedFile(Handler):
     BY_LINE_THRESHOLD = 1024 * 1024
+    READ_AHEAD_DEPTH = 8
+    READ_AHEAD_BLOCK = 1024 * 1024
+    CHECK_ROWS = 1024
+
+    def __init__(self, name, start=None, stop=None):
+        """
 
-    def __init__(self, name):
+        :param start: Only read from this byte, which should be the start of a line
+        :param stop: Only read up to this byte, which should be the end of a line
+        """
         if not name or not isinstance(name, str):
             raise ValueError
         self.__name = name
-        self.__file = open(name)
-        self.__size = os.path.getsize(name)
+        if start is None:
+            self.__file = open(name)
+            self.__size = os.path.getsize(name)
+        else:
+            self.__file = io.TextIOWrapper(io.BufferedReader(ByteRange(name, start, stop)))
+            self.__size = stop - start
+        self.__read = 0
+        self.__progress = None
+        self.read_ahead = None
 
     def __repr__(self):
         return "OpenedFile '{}' {} bytes".format(self.__name, self.__size)
 
+    @property
+    def bytes_read(self):
+        if self.__file.closed:
+            return self.__read
+        return self.__file.buffer.tell()
+
     def close(self, **kwargs):
+        if self.read_ahead is not None:
+            self.read_ahead.stop()
+        if self.__progress is not None:
+            self.__progress.clear()
+        if not self.__file.closed:
+            self.__read = self.__file.buffer.tell()
         self.__file.close()
 
     def read_lines(self, console, **kwargs):
@@ -234,18 +698,105 @@ class OpenedFile(Handler):
             self.close(console=console, **kwargs)
             return lines
 
-    def read_by_line(self, **kwargs):
+    def __tracked(self, items, console):
+        """
+        Iterate `items` while reading the file, showing the progress on `console`,
+        and closing the file at a row boundary when `console` is interrupted.
+
+        Both are only checked every `CHECK_ROWS` rows.
+        """
+        if console is None:
+            return items
+        self.__progress = console.new_progress(self.__size)
+        progress = self.__progress
+        interrupt = console.interrupt
+
+        def __iter():
+            rows = 0
+            for item in items:
+                yield item
+                rows += 1
+                if not rows % OpenedFile.CHECK_ROWS:
+                    if interrupt.requested:
+                        interrupt.rows = rows
+                        self.close()
+                        break
+                    if progress is not None:
+                        progress.update(self.bytes_read, rows)
+            if progress is not None:
+                progress.clear()
+
+        return __iter()
+
+    def read_by_line(self, arg=None, error=None, console=None, **kwargs):
+        if arg:
+            args = arg.split()
+            if args[0] != "prefetch" or len(args) > 3:
+                error("Invalid argument")
+            try:
+                depth = int(args[1]) if len(args) > 1 else OpenedFile.READ_AHEAD_DEPTH
+                block = int(args[2]) if len(args) > 2 else OpenedFile.READ_AHEAD_BLOCK
+            except ValueError:
+                error("Invalid argument")
+            if depth <= 0 or block <= 0:
+                error("Invalid argument")
+        else:
+            depth = None
+
         def __iter():
-            for line in self.__file:
+            if depth is None:
+                lines = self.__file
+            else:
+                self.read_ahead = ReadAhead(self.__file, depth, block)
+                lines = self.read_ahead
+            for line in self.__tracked(lines, console):
                 yield line
 
         def __exit():
-            self.close(**kwargs)
+            self.close(arg=arg, error=error, console=console, **kwargs)
 
         return Iterator(Line, __exit)(__iter)
 
+    def read_bytes(self, arg, error, console=None, **kwargs):
+        if arg:
+            error("Invalid argument")
+
+        def __iter():
+            for line in self.__tracked(self.__file.buffer, console):
+                yield line
+
+        def __exit():
+            self.close(arg=arg, error=error, console=console, **kwargs)
+
+        return Iterator(BytesLine, __exit)(__iter)
+
+    def read_format(self, arg, error, console=None, **kwargs):
+        if arg not in READ_FORMATS:
+            error("Please specify a format: {}".format(", ".join(sorted(READ_FORMATS))))
+        parse = READ_FORMATS[arg]
+
+        def __iter():
+            lines = []
+            for line in self.__tracked(self.__file, console):
+                lines.append(line)
+                if len(lines) >= Collection.BATCH_SIZE:
+                    for item in parse(lines):
+                        yield item
+                    lines = []
+            if lines:
+                for item in parse(lines):
+                    yield item
+
+        def __exit():
+            self.close(arg=arg, error=error, console=console, **kwargs)
+
+        return Iterator(Dictionary, __exit)(__iter)
+
 
 class Collection(Handler):
+    BATCH_SIZE = 4096
+    INFER_SAMPLE = 1000
+
     def __init__(self, type):
         self._type = type
 
@@ -265,19 +816,30 @@ class Collection(Handler):
     def _get_items(self, type, converter, match):
         pass
 
+    def _get_batches(self, type, func):
+        """
+
+        :param func: Converts a list of item contents into a list of projected item contents
+        """
+        pass
+
     def execute_cmd(self, cmd, **kwargs):
         arg = kwargs["arg"]
-        if arg and "@" in arg and cmd != "group":
+        if arg and "@" in arg and cmd not in ["group", "count-distinct", "join", "left-join"]:
             arg1, arg2 = [a.strip() for a in arg.rsplit("@", 1)]
-            console = kwargs["console"]
-            if cmd == "sort":
-                line = "group @ {} && un-group".format(arg2)
-            else:
-                line = "group @ {} && {} {} && un-group".format(arg2, cmd, arg1)
-            console.line(line)
-            return console.result
+            kwargs = {k: v for k, v in kwargs.items() if k != "arg"}
+            group = self.execute_cmd(cmd="group", arg="@ " + arg2, **kwargs)
+            if cmd != "sort":
+                group = group.execute_cmd(cmd=cmd, arg=arg1, **kwargs)
+            return group.execute_cmd(cmd="un-group", arg=None, **kwargs)
         elif cmd in self._type.PROJECTED_TYPE:
             projected_type = self._type.PROJECTED_TYPE[cmd]
+            method = self._type.get_handler_method(cmd)
+            if hasattr(method, "batch"):
+                arg = method.parse(arg, kwargs["error"])
+                kwargs = {k: v for k, v in kwargs.items() if k != "arg"}
+                return self._get_batches(projected_type,
+                                         lambda items: method.batch(items, arg, **kwargs))
             return self.get_items(projected_type,
                                   converter=lambda item: item.execute_cmd(cmd=cmd, **kwargs))
         else:
@@ -290,12 +852,13 @@ class Collection(Handler):
     def keep(self, arg, error, **kwargs):
         if not arg:
             error("Please specify criteria")
-        return self.get_items(self._type, match=lambda item: item.match(arg))
+        return self.get_items(self._type, match=self._type.matcher(arg, error))
 
     def throw(self, arg, error, **kwargs):
         if not arg:
             error("Please specify criteria")
-        return self.get_items(self._type, match=lambda item: not item.match(arg))
+        match = self._type.matcher(arg, error)
+        return self.get_items(self._type, match=lambda item: not match(item))
 
     def _save_lines(self):
         for item in self:
@@ -355,52 +918,420 @@ class Collection(Handler):
             error("Invalid argument")
         return group
 
+    def count_distinct(self, arg, error, **kwargs):
+        if self._type is not Dictionary:
+            error("`count-distinct` can only apply to Dictionary")
+        if not arg or "@" not in arg:
+            error("Invalid argument")
+        args, group_args = [a.split() for a in arg.rsplit("@", 1)]
+        if len(args) == 1:
+            key, precision = args[0], 12
+        elif len(args) == 2:
+            key, precision = args[0], args[1]
+        else:
+            error("Invalid argument")
+        group_args = list(resolve_group_args(*group_args))
+        if not group_args:
+            error("Invalid argument")
+        group_keys = [k for k, s in group_args]
 
-class List(Collection):
-    def __init__(self, type):
-        Collection.__init__(self, type)
-        self.__items = []
-
-    def __call__(self, items):
-        self.__items = list(self._type.items(items))
-        return self
+        counters = {}
+        seen = []
+        try:
+            precision = int(precision)
+            for item in self:
+                val = tuple(item[k] for k in group_keys)
+                if val not in counters:
+                    counters[val] = HyperLogLog(precision)
+                    seen.append(val)
+                counters[val].add(item[key])
+        except (KeyError, ValueError):
+            error("Invalid argument")
 
-    def __repr__(self):
-        return Collection.__repr__(self) + "[{}]".format(len(self))
+        result = []
+        for val in sort_group_keys(seen, [s for k, s in group_args]):
+            d = SequenceDict()
+            for k, v in zip(group_keys, val):
+                d[k] = v
+            d[key] = counters[val].estimate()
+            result.append(d)
+        return List(Dictionary)(result)
 
-    def __iter__(self):
-        return self.__items.__iter__()
+    def _join(self, arg, error, console, left):
+        if self._type is not Dictionary:
+            error("`join` can only apply to Dictionary")
+        if not arg or "@" not in arg:
+            error("Invalid argument")
+        name, keys = arg.rsplit("@", 1)
+        name, keys = name.strip(), keys.split()
+        if not name or not keys:
+            error("Invalid argument")
+        if name not in console.stored_values:
+            error("Value '{}' not found".format(name))
+        build = console.stored_values[name]
+        if isinstance(build, Cache) and build._type is Dictionary:
+            build = build.load(name, error).do()
+        if not isinstance(build, List) or build._type is not Dictionary:
+            error("`join` can only use a stored List of Dictionary")
+        try:
+            index, columns = build.index(*keys)
+        except KeyError:
+            error("Invalid argument")
+        columns = [k for k in columns if k not in keys]
 
-    def __len__(self):
-        return len(self.__items)
+        def __iter():
+            for item in self:
+                try:
+                    matches = index.get(tuple(item[k] for k in keys))
+                except KeyError:
+                    error("Invalid argument")
+                if matches is None:
+                    if not left:
+                        continue
+                    matches = [None]
+                for match in matches:
+                    d = SequenceDict()
+                    for k in item:
+                        d[k] = item[k]
+                    for k in columns:
+                        if k not in d:
+                            d[k] = match[k] if match is not None and k in match else None
+                    yield d
 
-    def _get_items(self, type, converter, match):
-        return List(type)([converter(item) for item in self if match(item)])
+        return __iter
 
-    def limit(self, **kwargs):
-        return List(self._type)([item for item in Collection.limit(self, **kwargs)()])
+    def __random(self, args, error):
+        try:
+            return random.Random(int(args[0]) if args else None)
+        except ValueError:
+            error("Invalid argument")
 
-    def print(self, console, **kwargs):
-        for line in self._save_lines():
-            console.output(line)
-        return self
+    def sample(self, arg, error, **kwargs):
+        args = arg.split() if arg else []
+        if len(args) not in [1, 2]:
+            error("Invalid argument")
+        try:
+            n = int(args[0])
+        except ValueError:
+            error("Invalid argument")
+        if n <= 0:
+            error("Invalid argument")
+        rng = self.__random(args[1:], error)
+
+        # Algorithm L: the number of items to skip before the next replacement
+        # is drawn directly, instead of drawing a random number for every item
+        def __weight():
+            return math.exp(math.log(1.0 - rng.random()) / n)
+
+        def __skip(w):
+            if w >= 1.0:
+                return 0
+            return int(math.log(1.0 - rng.random()) / math.log(1.0 - w))
+
+        reservoir = []
+        w = __weight()
+        replace_at = n + __skip(w)
+        for i, item in enumerate(self):
+            if i < n:
+                reservoir.append((i, item))
+            elif i == replace_at:
+                reservoir[rng.randrange(n)] = (i, item)
+                w *= __weight()
+                replace_at += __skip(w) + 1
+        reservoir.sort(key=lambda x: x[0])
+        return List(self._type)([item for i, item in reservoir])
+
+    def sample_rate(self, arg, error, **kwargs):
+        args = arg.split() if arg else []
+        if len(args) not in [1, 2]:
+            error("Invalid argument")
+        try:
+            p = float(args[0])
+        except ValueError:
+            error("Invalid argument")
+        if not 0 <= p <= 1:
+            error("Invalid argument")
+        rng = self.__random(args[1:], error)
 
-    def save(self, **kwargs):
-        Collection.save(self, **kwargs)
-        return self
+        # The gap between two kept items follows a geometric distribution
+        def __skip():
+            if p >= 1:
+                return 0
+            if p <= 0:
+                return -1
+            return int(math.log(1.0 - rng.random()) / math.log(1.0 - p))
 
-    def store(self, arg, console, **kwargs):
-        console.stored_values[arg] = self
-        return self
+        def __iter():
+            skip = __skip()
+            for item in self:
+                if skip:
+                    skip -= 1
+                    continue
+                yield item
+                skip = __skip()
 
+        return __iter
 
-class Iterator(Collection):
-    def __init__(self, type, exit):
-        Collection.__init__(self, type)
-        self.exit = exit
+    def _dedup(self, arg, error, seen):
+        """
 
-    def __iter__(self):
-        return self.__iter()
+        :param seen: Adds a digest, and returns True if it was added before
+        """
+        keys = arg.split() if arg else []
+        if keys and self._type is Line:
+            error("Invalid argument")
+        if self._type is SplitLine:
+            try:
+                keys = [int(k) for k in keys]
+            except ValueError:
+                error("Invalid argument")
+
+        def __iter():
+            for item in self:
+                if keys:
+                    try:
+                        text = "\0".join(str(item[k]) for k in keys)
+                    except (KeyError, IndexError):
+                        error("Invalid argument")
+                else:
+                    text = str(item)
+                if not seen(digest(text)):
+                    yield item
+
+        return __iter
+
+    def dedup(self, arg, error, **kwargs):
+        digests = set()
+
+        def __seen(digest):
+            if digest in digests:
+                return True
+            digests.add(digest)
+            return False
+
+        return self._dedup(arg, error, __seen)
+
+    def dedup_bloom(self, arg, error, **kwargs):
+        args = arg.split() if arg else []
+        if len(args) < 2:
+            error("Invalid argument")
+        try:
+            bloom = BloomFilter(int(args[0]), float(args[1]))
+        except ValueError:
+            error("Invalid argument")
+        return self._dedup(" ".join(args[2:]), error, bloom.add)
+
+    def join(self, **kwargs):
+        return self._join(left=False, **kwargs)
+
+    def left_join(self, **kwargs):
+        return self._join(left=True, **kwargs)
+
+    def infer_types(self, arg, error, console, **kwargs):
+        if self._type is not Dictionary:
+            error("`infer-types` can only apply to Dictionary")
+        try:
+            sample = int(arg) if arg else Collection.INFER_SAMPLE
+        except ValueError:
+            error("Invalid argument")
+        if sample <= 0:
+            error("Invalid argument")
+
+        def __convert(items, converters, unconverted):
+            """
+            Convert the values of `items`. A key turns from `int` into `float` at its first
+            value that needs it, and values that cannot be converted are left unchanged.
+            """
+            result = []
+            for item in items:
+                d = SequenceDict()
+                for k in item:
+                    v = item[k]
+                    converter = converters.get(k)
+                    if converter is not None and isinstance(v, str):
+                        try:
+                            v = converter(v)
+                        except ValueError:
+                            try:
+                                if converter is not int:
+                                    raise ValueError
+                                v = float(v)
+                                converters[k] = float
+                            except ValueError:
+                                unconverted[k] = unconverted.get(k, 0) + 1
+                    d[k] = v
+                result.append(d)
+            return result
+
+        def __iter():
+            items = iter(self)
+            head = []
+            for item in items:
+                head.append(item._item)
+                if len(head) >= sample:
+                    break
+            values = {}
+            for item in head:
+                for k in item:
+                    values.setdefault(k, []).append(item[k])
+            converters = {}
+            for k in values:
+                converter = infer_type(values[k])
+                if converter is not None:
+                    converters[k] = converter
+
+            def __name(k):
+                if k in converters:
+                    return converters[k].__name__
+                return type(next((v for v in values[k] if v is not None), "")).__name__
+
+            console.message("Types: " + " ".join("{}={}".format(k, __name(k)) for k in values))
+
+            inferred = dict(converters)
+            unconverted = {}
+            for i in __convert(head, converters, unconverted):
+                yield i
+            batch = []
+            for item in items:
+                batch.append(item._item)
+                if len(batch) >= Collection.BATCH_SIZE:
+                    for i in __convert(batch, converters, unconverted):
+                        yield i
+                    batch = []
+            for i in __convert(batch, converters, unconverted):
+                yield i
+
+            widened = [k for k in converters if converters[k] is not inferred[k]]
+            if widened:
+                console.message("Changed to float: " + " ".join(widened))
+            if unconverted:
+                console.message("Left unconverted: " + " ".join(
+                    "{}={}".format(k, unconverted[k]) for k in unconverted))
+
+        return __iter
+
+
+class List(Collection):
+    def __init__(self, type):
+        Collection.__init__(self, type)
+        self.__items = []
+        self.__indexes = {}
+
+    def __call__(self, items):
+        self.__items = list(self._type.items(items))
+        self.__indexes = {}
+        return self
+
+    def __repr__(self):
+        return Collection.__repr__(self) + "[{}]".format(len(self))
+
+    def __iter__(self):
+        return self.__items.__iter__()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def _get_items(self, type, converter, match):
+        return List(type)([converter(item) for item in self if match(item)])
+
+    def _get_batches(self, type, func):
+        items = []
+        for i in range(0, len(self), Collection.BATCH_SIZE):
+            items.extend(func([item._item for item in self.__items[i:i + Collection.BATCH_SIZE]]))
+        return List(type)(items)
+
+    def limit(self, **kwargs):
+        return List(self._type)([item for item in Collection.limit(self, **kwargs)()])
+
+    def nbytes(self, sample=100):
+        return self.memory(sample)[0]
+
+    def memory(self, sample=None):
+        """
+        Estimate the memory used by the entries, from the first `sample` of them (default: all).
+
+        :return: The number of bytes, and the share of strings in the entries that are
+            pooled in `STRINGS` (None if there are no strings)
+        """
+        if not self.__items:
+            return sys.getsizeof(self.__items), None
+        items = self.__items if sample is None else self.__items[:sample]
+        seen = set()
+        strings = []
+        size = sum(sys.getsizeof(item) + sizeof(item._item, seen, strings) for item in items)
+        pooled = sum(1 for s in strings if STRINGS.pooled(s)) / len(strings) if strings else None
+        return sys.getsizeof(self.__items) + size * len(self.__items) // len(items), pooled
+
+    def print(self, arg, error, console, **kwargs):
+        if arg == "--page":
+            console.page(self._save_lines())
+            return self
+        lines = self._save_lines()
+        if arg:
+            try:
+                n = int(arg)
+            except ValueError:
+                error("Invalid argument")
+            if n < 0:
+                error("Invalid argument")
+            lines = (line for i, line in zip(range(n), lines))
+        console.output_lines(lines)
+        return self
+
+    def save(self, **kwargs):
+        Collection.save(self, **kwargs)
+        return self
+
+    def store(self, arg, console, **kwargs):
+        console.stored_values[arg] = self
+        return self
+
+    def index(self, *keys):
+        """
+        Build a hash index of a List of Dictionary, or reuse the one built before.
+
+        :return: A dict from tuples of values of `keys` to lists of items,
+            and all keys of the items in the order they were first seen
+        """
+        if keys not in self.__indexes:
+            index = {}
+            columns = []
+            seen = set()
+            for item in self:
+                index.setdefault(tuple(item[k] for k in keys), []).append(item)
+                for k in item:
+                    if k not in seen:
+                        seen.add(k)
+                        columns.append(k)
+            self.__indexes[keys] = (index, columns)
+        return self.__indexes[keys]
+
+    def sample_rate(self, **kwargs):
+        return List(self._type)(Collection.sample_rate(self, **kwargs)())
+
+    def infer_types(self, **kwargs):
+        return List(self._type)(Collection.infer_types(self, **kwargs)())
+
+    def dedup(self, **kwargs):
+        return List(self._type)(Collection.dedup(self, **kwargs)())
+
+    def dedup_bloom(self, **kwargs):
+        return List(self._type)(Collection.dedup_bloom(self, **kwargs)())
+
+    def join(self, **kwargs):
+        return List(Dictionary)(Collection.join(self, **kwargs)())
+
+    def left_join(self, **kwargs):
+        return List(Dictionary)(Collection.left_join(self, **kwargs)())
+
+
+class Iterator(Collection):
+    def __init__(self, type, exit):
+        Collection.__init__(self, type)
+        self.exit = exit
+
+    def __iter__(self):
+        return self.__iter()
 
     def __iter(self):
         pass
@@ -417,6 +1348,21 @@ class Iterator(Collection):
 
         return Iterator(type, self.exit)(__iter)
 
+    def _get_batches(self, type, func):
+        def __iter():
+            items = []
+            for item in self:
+                items.append(item._item)
+                if len(items) >= Collection.BATCH_SIZE:
+                    for i in func(items):
+                        yield i
+                    items = []
+            if items:
+                for i in func(items):
+                    yield i
+
+        return Iterator(type, self.exit)(__iter)
+
     def limit(self, **kwargs):
         return Iterator(self._type, self.exit)(Collection.limit(self, **kwargs))
 
@@ -432,6 +1378,106 @@ class Iterator(Collection):
         Collection.save(self, **kwargs)
         self.exit()
 
+    def count_distinct(self, **kwargs):
+        result = Collection.count_distinct(self, **kwargs)
+        self.exit()
+        return result
+
+    def sample(self, **kwargs):
+        result = Collection.sample(self, **kwargs)
+        self.exit()
+        return result
+
+    def sample_rate(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.sample_rate(self, **kwargs))
+
+    def infer_types(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.infer_types(self, **kwargs))
+
+    def dedup(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.dedup(self, **kwargs))
+
+    def dedup_bloom(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.dedup_bloom(self, **kwargs))
+
+    def join(self, **kwargs):
+        return Iterator(Dictionary, self.exit)(Collection.join(self, **kwargs))
+
+    def left_join(self, **kwargs):
+        return Iterator(Dictionary, self.exit)(Collection.left_join(self, **kwargs))
+
+    def store(self, arg, console, **kwargs):
+        cache = Cache(self._type)
+        console.stored_values[arg] = cache
+
+        def __iter():
+            for item in self:
+                cache.append(item._item)
+                yield item
+            # Reading stops early at Ctrl-C, so the entries may be partial
+            cache.complete = not console.interrupt.requested
+
+        return Iterator(self._type, self.exit)(__iter)
+
+
+class Cache(object):
+    """
+    Entries recorded from an `Iterator` by `store`, to be replayed by `load`.
+
+    Lines are kept as strings, split lines as tuples, and dictionaries as tuples of
+    values, grouped in runs that share the same keys.
+    """
+
+    def __init__(self, type):
+        self._type = type
+        self.complete = False
+        self.__runs = []
+        self.__keys = None
+        self.__rows = None
+        self.__len = 0
+
+    def __repr__(self):
+        return "Cache({}, {} entries{})".format(
+            self._type.__name__, self.__len, "" if self.complete else ", incomplete")
+
+    def __len__(self):
+        return self.__len
+
+    def append(self, item):
+        if self._type is Dictionary:
+            keys = tuple(item)
+            if keys != self.__keys:
+                self.__keys = keys
+                self.__rows = []
+                self.__runs.append((keys, self.__rows))
+            self.__rows.append(tuple(item[k] for k in keys))
+        else:
+            if self.__rows is None:
+                self.__rows = []
+                self.__runs.append((None, self.__rows))
+            self.__rows.append(tuple(item) if self._type is SplitLine else item)
+        self.__len += 1
+
+    def __iter(self):
+        for keys, rows in self.__runs:
+            if keys is not None:
+                for values in rows:
+                    d = SequenceDict()
+                    for k, v in zip(keys, values):
+                        d[k] = v
+                    yield d
+            elif self._type is SplitLine:
+                for values in rows:
+                    yield list(values)
+            else:
+                for item in rows:
+                    yield item
+
+    def load(self, name, error):
+        if not self.complete:
+            error("Value '{}' was not read to the end".format(name))
+        return Iterator(self._type, lambda: None)(self.__iter)
+
 
 class Iterable(Handler):
     PROJECTED_TYPE = {}
@@ -443,10 +1489,34 @@ class Iterable(Handler):
         return self._item
 
     @classmethod
-    def project(cls, name, type):
+    def project(cls, name, type, parse=None, batch=False):
+        """
+        Register a projection.
+
+        :param name: The command
+        :param type: The type after projection
+        :param parse: Turns `arg` and `error` into the parsed argument (default: `arg` itself).
+            Only used for batch projections.
+        :param batch: If True, the decorated function takes a list of items (the contents
+            of Iterables, not the Iterables themselves), the parsed argument and `error`,
+            and returns a list of projected items. The argument is parsed once per command.
+        """
+        if parse is None:
+            parse = lambda arg, error: arg
+
         def __decor(func):
+            if "PROJECTED_TYPE" not in cls.__dict__:
+                cls.PROJECTED_TYPE = dict(cls.PROJECTED_TYPE)
             cls.PROJECTED_TYPE[name] = type
-            setattr(cls, name.replace("-", "_"), func)
+            if batch:
+                def __project(self, arg, error, **kwargs):
+                    return func([self._item], parse(arg, error), error=error, **kwargs)[0]
+
+                __project.parse = parse
+                __project.batch = func
+                setattr(cls, name.replace("-", "_"), __project)
+            else:
+                setattr(cls, name.replace("-", "_"), func)
             return func
 
         return __decor
@@ -473,6 +1543,13 @@ class Iterable(Handler):
     def match(self, arg):
         return True
 
+    @classmethod
+    def matcher(cls, arg, error):
+        """
+        :return: A function that tells whether an item matches the criteria `arg`
+        """
+        return lambda item: item.match(arg)
+
 
 class Line(Iterable):
     def __init__(self, item):
@@ -482,6 +1559,30 @@ class Line(Iterable):
         return re.search(arg, self._item) is not None
 
 
+class BytesLine(Iterable):
+    """
+    A line that has not been decoded yet.
+    """
+    ENCODING = "utf-8"
+
+    def __init__(self, item):
+        self._item = item.strip()
+
+    def __str__(self):
+        return self._item.decode(BytesLine.ENCODING, "replace")
+
+    def match(self, arg):
+        return re.search(arg.encode(BytesLine.ENCODING), self._item) is not None
+
+    @classmethod
+    def matcher(cls, arg, error):
+        try:
+            search = re.compile(arg.encode(BytesLine.ENCODING)).search
+        except re.error:
+            error("Invalid regex")
+        return lambda item: search(item._item) is not None
+
+
 class SplitLine(Iterable):
     def __str__(self):
         result = ""
@@ -531,279 +1632,1009 @@ class Dictionary(Iterable):
         return eval(arg)
 
 
-@Line.project("split", SplitLine)
-def __line_split(self, arg, **kwargs):
-    return self._item.split(arg)
+def __parse_indexes(arg, error):
+    try:
+        return [int(i) for i in arg.split()]
+    except (AttributeError, ValueError):
+        error("Invalid argument")
 
 
-@SplitLine.project("split", SplitLine)
-def __splitline_split(self, arg, **kwargs):
-    def __iter():
-        for item in self:
-            for i in item.split(arg):
-                yield i
+def __parse_keys(arg, error):
+    if not arg:
+        error("Invalid argument")
+    return arg.split()
+
+
+def __parse_index_text(arg, error):
+    try:
+        index, content = arg.split(None, 1)
+        return int(index), content
+    except (AttributeError, ValueError):
+        error("Invalid argument")
+
+
+@Line.project("split", SplitLine, batch=True)
+def __line_split(items, arg, **kwargs):
+    return [item.split(arg) for item in items]
+
+
+DECODE_ERRORS = ["replace", "strict", "ignore", "backslashreplace", "skip"]
+
+
+def __parse_decode(arg, error):
+    args = arg.split() if arg else []
+    if len(args) > 2:
+        error("Invalid argument")
+    errors = args[0] if args else DECODE_ERRORS[0]
+    encoding = args[1] if len(args) > 1 else BytesLine.ENCODING
+    if errors not in DECODE_ERRORS:
+        error("Please specify an error policy: {}".format(", ".join(DECODE_ERRORS)))
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        error("Unknown encoding '{}'".format(encoding))
+    return errors, encoding
+
+
+@BytesLine.project("decode", Line, parse=__parse_decode, batch=True)
+def __bytesline_decode(items, args, error, **kwargs):
+    errors, encoding = args
+    if errors == "skip":
+        result = []
+        for item in items:
+            try:
+                result.append(item.decode(encoding))
+            except UnicodeDecodeError:
+                pass
+        return result
+    try:
+        return [item.decode(encoding, errors) for item in items]
+    except UnicodeDecodeError as e:
+        error("Cannot decode line: {}".format(e))
+
 
-    return list(__iter())
+PARSE_CASTS = {"int": int, "number": float}
 
 
-@SplitLine.project("take", SplitLine)
-def __splitline_take(self, arg, error, **kwargs):
+def __parse_regex(arg, error):
+    if not arg:
+        error("Please specify a regex")
     try:
-        return [self[int(i)] for i in arg.split()]
-    except IndexError or ValueError:
+        pattern = re.compile(arg)
+    except re.error:
+        error("Invalid regex")
+    if not pattern.groupindex:
+        error("The regex has no named groups")
+    fields = []
+    for name, index in sorted(pattern.groupindex.items(), key=lambda x: x[1]):
+        key, sep, cast = name.rpartition("__")
+        if sep and key and cast in PARSE_CASTS:
+            fields.append((index - 1, STRINGS.key(key), PARSE_CASTS[cast]))
+        else:
+            fields.append((index - 1, STRINGS.key(name), None))
+    return pattern, fields
+
+
+@Line.project("parse", Dictionary, parse=__parse_regex, batch=True)
+def __line_parse(items, arg, error, **kwargs):
+    pattern, fields = arg
+    search = pattern.search
+    result = []
+    try:
+        for item in items:
+            m = search(item)
+            if m is None:
+                continue
+            groups = m.groups()
+            d = SequenceDict()
+            for index, key, cast in fields:
+                value = groups[index]
+                d[key] = STRINGS.value(key, value) if cast is None or value is None else cast(value)
+            result.append(d)
+    except ValueError:
         error("Invalid argument")
+    return result
+
+
+@SplitLine.project("split", SplitLine, batch=True)
+def __splitline_split(items, arg, **kwargs):
+    return [[i for part in item for i in part.split(arg)] for item in items]
 
 
-@SplitLine.project("int", SplitLine)
-def __splitline_int(self, arg, error, **kwargs):
+@SplitLine.project("take", SplitLine, parse=__parse_indexes, batch=True)
+def __splitline_take(items, indexes, error, **kwargs):
     try:
-        indexes = [int(i) for i in arg.split()]
-        return [int(self[i]) if i in indexes else self[i]
-                for i in range(len(self))]
-    except IndexError or ValueError:
+        return [[item[i] for i in indexes] for item in items]
+    except IndexError:
         error("Invalid argument")
 
 
-@SplitLine.project("number", SplitLine)
-def __splitline_float(self, arg, error, **kwargs):
+def __splitline_convert(items, indexes, converter, error):
+    result = []
     try:
-        indexes = [int(i) for i in arg.split()]
-        return [float(self[i]) if i in indexes else self[i]
-                for i in range(len(self))]
-    except IndexError or ValueError:
+        for item in items:
+            item = list(item)
+            for i in indexes:
+                if 0 <= i < len(item):
+                    item[i] = converter(item[i])
+            result.append(item)
+    except ValueError:
         error("Invalid argument")
+    return result
 
 
-@SplitLine.project("make-dict", Dictionary)
-def __splitline_kv(self, arg, **kwargs):
-    d = SequenceDict()
-    for i in self:
-        try:
-            k, v = i.split(arg, 1)
-        except ValueError:
-            k, v = i, None
-        d[k] = v
-    return d
+@SplitLine.project("int", SplitLine, parse=__parse_indexes, batch=True)
+def __splitline_int(items, indexes, error, **kwargs):
+    return __splitline_convert(items, indexes, int, error)
 
 
-@SplitLine.project("add-before", SplitLine)
-def __splitline_add_before(self, arg, error, **kwargs):
+@SplitLine.project("number", SplitLine, parse=__parse_indexes, batch=True)
+def __splitline_float(items, indexes, error, **kwargs):
+    return __splitline_convert(items, indexes, float, error)
+
+
+@SplitLine.project("make-dict", Dictionary, batch=True)
+def __splitline_kv(items, arg, **kwargs):
+    result = []
+    for item in items:
+        d = SequenceDict()
+        for i in item:
+            kv = i.split(arg, 1)
+            if len(kv) == 2:
+                key = STRINGS.key(kv[0])
+                d[key] = STRINGS.value(key, kv[1])
+            else:
+                d[STRINGS.key(i)] = None
+        result.append(d)
+    return result
+
+
+def __splitline_edit(items, index, editor, error):
+    result = []
     try:
-        index, content = arg.split(None, 1)
-        index = int(index)
-        length = len(self)
-        return [content + self[i] if i == index % length  else self[i]
-                for i in range(length)]
-    except IndexError or ValueError or TypeError:
+        for item in items:
+            item = list(item)
+            i = index % len(item)
+            item[i] = editor(item[i])
+            result.append(item)
+    except (ZeroDivisionError, TypeError, AttributeError):
+        error("Invalid argument")
+    return result
+
+
+@SplitLine.project("add-before", SplitLine, parse=__parse_index_text, batch=True)
+def __splitline_add_before(items, args, error, **kwargs):
+    index, content = args
+    return __splitline_edit(items, index, lambda part: content + part, error)
+
+
+@SplitLine.project("add-after", SplitLine, parse=__parse_index_text, batch=True)
+def __splitline_add_after(items, args, error, **kwargs):
+    index, content = args
+    return __splitline_edit(items, index, lambda part: part + content, error)
+
+
+def __parse_replace(arg, error):
+    try:
+        index, replace, replace_with = arg.split(None, 2)
+        return int(index), replace, replace_with
+    except (AttributeError, ValueError):
         error("Invalid argument")
 
 
-@SplitLine.project("add-after", SplitLine)
-def __splitline_add_after(self, arg, error, **kwargs):
+@SplitLine.project("replace", SplitLine, parse=__parse_replace, batch=True)
+def __splitline_replace(items, args, error, **kwargs):
+    index, replace, replace_with = args
+    return __splitline_edit(items, index, lambda part: part.replace(replace, replace_with), error)
+
+
+@Dictionary.project("take", Dictionary, parse=__parse_keys, batch=True)
+def __dictionary_take(items, keys, error, **kwargs):
+    result = []
     try:
-        index, content = arg.split(None, 1)
-        index = int(index)
-        length = len(self)
-        return [self[i] + content if i == index % length else self[i]
-                for i in range(length)]
-    except IndexError or ValueError or TypeError:
+        for item in items:
+            d = SequenceDict()
+            for k in keys:
+                d[k] = item[k]
+            result.append(d)
+    except KeyError:
         error("Invalid argument")
+    return result
 
 
-@SplitLine.project("replace", SplitLine)
-def __splitline_add_after(self, arg, error, **kwargs):
+def __dictionary_convert(items, keys, converter, error):
+    keys = set(keys)
+    result = []
     try:
-        index, replace, replace_with = arg.split(None, 2)
-        index = int(index)
-        length = len(self)
-        return [self[i].replace(replace, replace_with) if i == index % length else self[i]
-                for i in range(length)]
-    except IndexError or ValueError or TypeError:
+        for item in items:
+            d = SequenceDict()
+            for k in item:
+                d[k] = converter(item[k]) if k in keys else item[k]
+            result.append(d)
+    except (TypeError, ValueError):
         error("Invalid argument")
+    return result
+
+
+@Dictionary.project("int", Dictionary, parse=__parse_keys, batch=True)
+def __dictionary_int(items, keys, error, **kwargs):
+    return __dictionary_convert(items, keys, int, error)
+
 
+@Dictionary.project("number", Dictionary, parse=__parse_keys, batch=True)
+def __dictionary_float(items, keys, error, **kwargs):
+    return __dictionary_convert(items, keys, float, error)
 
-@Dictionary.project("take", Dictionary)
-def __dictionary_take(self, arg, error, **kwargs):
+
+def __parse_rename(arg, error):
+    if not arg:
+        error("Invalid argument")
+    args = arg.split()
+    if len(args) != 2:
+        error("Invalid argument")
+    return args
+
+
+@Dictionary.project("rename", Dictionary, parse=__parse_rename, batch=True)
+def __dictionary_rename(items, args, error, **kwargs):
+    old_key, new_key = args
+    result = []
+    for item in items:
+        if old_key not in item:
+            error("Invalid argument")
+        elif new_key in item:
+            error("Invalid argument")
+        d = SequenceDict()
+        for key in item:
+            if key == old_key:
+                d[new_key] = item[old_key]
+            else:
+                d[key] = item[key]
+        result.append(d)
+    return result
+
+
+def __parse_bucket(arg, error):
     try:
+        key, args = arg.split(None, 1)
+        fmt, width = args.rsplit(None, 1)
+        return key, TimeBuckets(fmt, parse_duration(width))
+    except (AttributeError, ValueError):
+        error("Invalid argument")
+
+
+@Dictionary.project("bucket", Dictionary, parse=__parse_bucket, batch=True)
+def __dictionary_bucket(items, args, error, **kwargs):
+    key, buckets = args
+    result = []
+    try:
+        for item in items:
+            d = SequenceDict()
+            for k in item:
+                d[k] = item[k]
+            d[key] = buckets(item[key])
+            result.append(d)
+    except (KeyError, ValueError, TypeError):
+        error("Invalid argument")
+    return result
+
+
+READ_FORMATS = {}
+
+
+def read_format(name):
+    """
+    Register a parser for `read-format`.
+
+    The decorated function takes a list of lines, and returns a list of dicts.
+    Lines that cannot be parsed are dropped.
+    """
+
+    def __decor(func):
+        READ_FORMATS[name] = func
+        return func
+
+    return __decor
+
+
+@read_format("jsonl")
+def __read_jsonl(lines):
+    # Each line is parsed by itself, so that an invalid line cannot merge with its neighbours
+    items = []
+    for line in lines:
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            pass
+    result = []
+    for item in items:
+        if isinstance(item, dict):
+            d = SequenceDict()
+            for k in item:
+                key = STRINGS.key(k)
+                d[key] = STRINGS.value(key, item[k])
+            result.append(d)
+    return result
+
+
+__LOGFMT_PAIR = re.compile(r'([^\s=]+)(?:(=)(?:"((?:[^"\\]|\\.)*)"|(\S*)))?')
+__ESCAPED = re.compile(r'\\(.)')
+
+
+@read_format("logfmt")
+def __read_logfmt(lines):
+    result = []
+    for line in lines:
+        d = SequenceDict()
+        for key, eq, quoted, value in __LOGFMT_PAIR.findall(line):
+            key = STRINGS.key(key)
+            if not eq:
+                d[key] = True
+            elif quoted:
+                d[key] = STRINGS.value(key, __ESCAPED.sub(r"\1", quoted) if "\\" in quoted else quoted)
+            else:
+                d[key] = STRINGS.value(key, value)
+        if len(d):
+            result.append(d)
+    return result
+
+
+__COMBINED = re.compile(
+    r'(\S+) (\S+) (\S+) \[([^\]]*)\] "((?:[^"\\]|\\.)*)" (\d{3}|-) (\d+|-)'
+    r'(?: "((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)")?'
+)
+
+
+@read_format("combined")
+def __read_combined(lines):
+    result = []
+    for line in lines:
+        m = __COMBINED.match(line)
+        if m is None:
+            continue
+        ip, ident, user, time, request, status, size, referer, agent = m.groups()
+        parts = request.split(" ")
+        if len(parts) == 3:
+            method, path, protocol = parts
+        else:
+            method, path, protocol = None, request, None
+        d = SequenceDict()
+        d["ip"] = STRINGS.value("ip", ip)
+        d["ident"] = STRINGS.value("ident", ident)
+        d["user"] = STRINGS.value("user", user)
+        d["time"] = time
+        d["method"] = STRINGS.value("method", method)
+        d["path"] = STRINGS.value("path", path)
+        d["protocol"] = STRINGS.value("protocol", protocol)
+        d["status"] = int(status) if status != "-" else None
+        d["bytes"] = int(size) if size != "-" else 0
+        d["referer"] = STRINGS.value("referer", referer)
+        d["agent"] = STRINGS.value("agent", agent)
+        result.append(d)
+    return result
+
+
+class Group(Handler):
+    def __init__(self, *keys):
+        """
+
+        :param keys: Each one is a key, or a (key, order) pair where order is "+", "-" or None
+        """
+        self.__keys = []
+        self.__orders = []
+        for key in keys:
+            if isinstance(key, list) or isinstance(key, tuple):
+                key, order = key
+            else:
+                order = None
+            self.__keys.append(key)
+            self.__orders.append(order)
+
+        self.__items = {}
+
+    def __repr__(self):
+        def __formatter(k, s):
+            if s is None:
+                return k
+            else:
+                return k + " " + s
+
+        return "Group [" + ", ".join(__formatter(k, s) for k, s in zip(self.__keys, self.__orders)) + "]"
+
+    def __iter(self):
+        for vals in sort_group_keys(self.__items, self.__orders):
+            yield vals, self.__items[vals]
+
+    def __iter__(self):
+        for vals, l in self.__iter():
+            for item in l:
+                yield item
+
+    def append(self, item):
+        vals = tuple(item[key] for key in self.__keys)
+        l = self.__items.get(vals)
+        if l is None:
+            l = self.__items[vals] = []
+        l.append(item)
+
+    def un_group(self, **kwargs):
+        a = List(Dictionary)(self)
+        return a
+
+    def __new_group(self, converter=None, l_converter=None):
+        group = Group(*zip(self.__keys, self.__orders))
+
+        if l_converter is not None:
+            for vals, l in self.__iter():
+                group.__items[vals] = [l_converter(vals, l)]
+        elif converter is not None:
+            for vals, l in self.__iter():
+                group.__items[vals] = [converter(vals, item) for item in l]
+        else:
+            raise ValueError
+
+        return group
+
+    def __key_dict(self, vals):
         d = SequenceDict()
-        for k in arg.split():
-            d[k] = self[k]
+        for k, v in zip(self.__keys, vals):
+            d[k] = v
         return d
-    except KeyError:
-        error("Invalid argument")
 
+    def add_count(self, arg, **kwargs):
+        if not arg:
+            arg = "count"
+
+        def __add_count(vals, item):
+            result = SequenceDict()
+            for k in item:
+                result[k] = item[k]
+            result[arg] = 1
+            return result
+
+        return self.__new_group(converter=__add_count)
+
+    def count(self, arg, **kwargs):
+        if not arg:
+            arg = "count"
+
+        def __count(vals, l):
+            result = self.__key_dict(vals)
+            result[arg] = len(l)
+            return result
+
+        return self.__new_group(l_converter=__count)
+
+    def sum(self, arg, error, **kwargs):
+        if not arg:
+            error("No argument given")
+        sum_keys = arg.split()
+
+        def __sum(vals, l):
+            result = self.__key_dict(vals)
+            for key in sum_keys:
+                val = 0
+                for item in l:
+                    val += item[key]
+                result[key] = val
+            return result
+
+        return self.__new_group(l_converter=__sum)
+
+
+# --- profiler.py ---
+
+def _max_rss():
+    """
+    Peak resident set size of the process in KB, or None if unknown.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def _rows(value):
+    if isinstance(value, List):
+        return len(value)
+    return None
+
+
+class Record(object):
+    def __init__(self, name, upstream=None, source=None):
+        self.name = name
+        self.upstream = upstream
+        self.source = source
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_read = 0
+        self.rss = None
+        self.rows_in = None
+        self.rows_out = None
+        self.lazy = False
+        self.done = True
+
+    def self_wall(self):
+        if self.upstream is not None and self.upstream.lazy:
+            return self.wall - self.upstream.wall
+        return self.wall
+
+    def self_cpu(self):
+        if self.upstream is not None and self.upstream.lazy:
+            return self.cpu - self.upstream.cpu
+        return self.cpu
+
+    def self_bytes_read(self):
+        if self.upstream is not None and self.upstream.lazy:
+            return self.bytes_read - self.upstream.bytes_read
+        return self.bytes_read
+
+
+class Profiler(object):
+    def __init__(self):
+        self.__records = []
+        self.__stages = {}
+
+    def __bytes_read(self, source):
+        if source is None:
+            return 0
+        return source.bytes_read
+
+    def command(self, cmd, arg, last, execute):
+        """
+        Execute a command and record its cost.
+
+        If the command results in an `Iterator`, it is wrapped so that the cost of
+        the lazy stage is recorded as well when it is eventually iterated.
+        """
+        stage = self.__stages.get(id(last))
+        upstream = stage[1] if stage is not None and stage[0] is last else None
+        if isinstance(last, OpenedFile):
+            source = last
+        elif upstream is not None:
+            source = upstream.source
+        else:
+            source = None
+
+        record = Record(cmd if not arg else cmd + " " + arg, upstream, source)
+        self.__records.append(record)
+        if upstream is None:
+            record.rows_in = _rows(last)
+
+        bytes_read = self.__bytes_read(source)
+        rss = _max_rss()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            result = execute()
+        finally:
+            record.wall = time.perf_counter() - wall
+            record.cpu = time.process_time() - cpu
+            record.bytes_read = self.__bytes_read(source) - bytes_read
+            if rss is not None:
+                record.rss = _max_rss() - rss
+
+        if isinstance(result, Iterator) and result is not last:
+            return self.__stage(record, result)
+        record.rows_out = _rows(result)
+        return result
+
+    def __stage(self, record, iterator):
+        record.lazy = True
+        record.done = False
+        record.rows_out = 0
+        source = record.source
+
+        def __iter():
+            items = iter(iterator)
+            rss = _max_rss()
+            try:
+                while True:
+                    bytes_read = self.__bytes_read(source)
+                    wall = time.perf_counter()
+                    cpu = time.process_time()
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        record.wall += time.perf_counter() - wall
+                        record.cpu += time.process_time() - cpu
+                        record.bytes_read += self.__bytes_read(source) - bytes_read
+                    record.rows_out += 1
+                    yield item
+            finally:
+                if rss is not None:
+                    record.rss = _max_rss() - rss
+                record.done = True
+
+        def __exit():
+            iterator.exit()
+            record.done = True
+
+        stage = Iterator(iterator._type, __exit)(__iter)
+        self.__stages[id(stage)] = (stage, record)
+        return stage
+
+    def report(self, console):
+        """
+        Print all records that are settled, and forget them.
+
+        Lazy stages that have not been iterated yet are kept for the next report.
+        """
+        records = [r for r in self.__records if r.done]
+        if not records:
+            return
+        self.__records = [r for r in self.__records if not r.done]
+        self.__stages = {k: v for k, v in self.__stages.items() if not v[1].done}
+
+        def __format(value, fmt="{}"):
+            if value is None:
+                return "-"
+            return fmt.format(value)
+
+        table = [["command", "wall(s)", "cpu(s)", "rows in", "rows out", "bytes read", "rss(KB)"]]
+        for r in records:
+            name = r.name if not r.lazy else r.name + " (lazy)"
+            table.append([
+                name,
+                __format(r.self_wall(), "{:.3f}"),
+                __format(r.self_cpu(), "{:.3f}"),
+                __format(r.upstream.rows_out if r.upstream is not None else r.rows_in),
+                __format(r.rows_out),
+                __format(r.self_bytes_read() if r.source is not None else None),
+                __format(r.rss),
+            ])
+        widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+        for row in table:
+            console.output("  ".join(
+                [row[0].ljust(widths[0])] +
+                [row[i].rjust(widths[i]) for i in range(1, len(row))]
+            ))
+        for r in records:
+            if r.upstream is None and r.source is not None and r.source.read_ahead is not None:
+                console.output("{}: {!r}".format(r.name, r.source.read_ahead))
+
+
+# --- cache.py ---
+
+# Commands whose result only depends on the previous result and the argument
+DETERMINISTIC = {
+    "read-lines", "read-by-line", "read-format", "read-bytes", "decode", "do",
+    "split", "parse", "make-dict", "keep", "throw", "take", "int", "number",
+    "add-before", "add-after", "replace", "rename", "bucket", "limit",
+    "group", "un-group", "sort", "count", "add-count", "sum", "count-distinct",
+    "dedup", "dedup-bloom", "infer-types",
+}
+
+# Commands that leave the data of the result unchanged
+PASS_THROUGH = {"print", "save", "store", "-", "profile", "progress", "cache", "mem", "tee"}
+
+
+def file_identity(name):
+    """
+    :return: (path, size, mtime) of a file, or None if it cannot be accessed
+    """
+    try:
+        path = os.path.abspath(name)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def next_lineage(lineage, cmd, arg):
+    """
+    The lineage of the result of a command, given the lineage of its input.
+
+    A lineage is a tuple of the identity of the opened file and every command
+    executed on it since, or None if the result cannot be reproduced that way.
+    """
+    if cmd == "open":
+        if not arg:
+            return None
+        identity = file_identity(arg.strip())
+        if identity is None:
+            return None
+        return identity,
+    if cmd in PASS_THROUGH:
+        return lineage
+    if lineage is None or cmd not in DETERMINISTIC:
+        return None
+    arg = arg.strip() if arg else ""
+    return lineage + ((cmd + " " + arg).strip(),)
+
+
+class ResultCache(object):
+    """
+    Results (`List`s) of command prefixes, evicted least recently used first
+    when their total estimated size exceeds `capacity` bytes.
+    """
+    DEFAULT_CAPACITY = 256 * 1024 * 1024
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.size = 0
+        self.hits = 0
+        self.__entries = collections.OrderedDict()
+
+    def __repr__(self):
+        return "ResultCache({} entries, {:.1f}/{:.1f} MB, {} hits)".format(
+            len(self.__entries), self.size / 1024 / 1024, self.capacity / 1024 / 1024, self.hits)
+
+    def __contains__(self, lineage):
+        return lineage in self.__entries
+
+    def get(self, lineage):
+        if lineage not in self.__entries:
+            return None
+        self.hits += 1
+        self.__entries.move_to_end(lineage)
+        return self.__entries[lineage][0]
+
+    def put(self, lineage, value, size):
+        if lineage in self.__entries:
+            self.size -= self.__entries.pop(lineage)[1]
+        if size > self.capacity:
+            return
+        self.__entries[lineage] = (value, size)
+        self.size += size
+        self.resize(self.capacity)
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        while self.size > self.capacity:
+            value, size = self.__entries.popitem(last=False)[1]
+            self.size -= size
+
+    def clear(self):
+        self.__entries.clear()
+        self.size = 0
+
+
+# --- parallel.py ---
+
+# Commands that read the file
+READERS = {"read-lines", "read-by-line", "read-bytes", "read-format"}
+
+# Commands that work on each entry by itself, and can run on any part of a file
+ROW_LOCAL = {
+    "do", "split", "parse", "make-dict", "decode", "keep", "throw", "take", "int", "number",
+    "add-before", "add-after", "replace", "rename", "bucket",
+}
+
+RANGES_PER_WORKER = 4
+MIN_RANGE = 1024 * 1024
+
+
+class Aggregate(object):
+    """
+    Aggregates of groups of entries, which can be merged with the aggregates of other entries.
+    """
+
+    def __init__(self, arg, error):
+        if not arg or "@" not in arg:
+            error("Invalid argument")
+        arg, group_args = [a.strip() for a in arg.rsplit("@", 1)]
+        self.group_args = list(resolve_group_args(*group_args.split()))
+        if not self.group_args:
+            error("Invalid argument")
+        self.keys = [k for k, s in self.group_args]
+        self.groups = {}
+        self.parse(arg, error)
+
+    def parse(self, arg, error):
+        pass
+
+    def new(self):
+        pass
+
+    def add(self, value, item):
+        """
+        Add an entry to the aggregate of its group.
+
+        :return: The new aggregate
+        """
+        pass
+
+    def combine(self, value, other):
+        """
+        :return: The aggregate of two parts of a group
+        """
+        pass
+
+    def fill(self, d, value):
+        """
+        Put the aggregate of a group into its result.
+        """
+        pass
 
-@Dictionary.project("int", Dictionary)
-def __dictionary_int(self, arg, error, **kwargs):
-    try:
-        d = SequenceDict()
-        int_keys = arg.split()
-        for k in self:
-            d[k] = self[k]
-            if k in int_keys:
-                d[k] = int(d[k])
-        return d
-    except KeyError or ValueError:
-        error("Invalid argument")
+    def add_all(self, items):
+        groups = self.groups
+        keys = self.keys
+        for item in items:
+            vals = tuple(item[k] for k in keys)
+            value = groups.get(vals)
+            if value is None:
+                value = self.new()
+            groups[vals] = self.add(value, item)
+
+    def merge(self, other):
+        for vals, value in other.groups.items():
+            if vals in self.groups:
+                self.groups[vals] = self.combine(self.groups[vals], value)
+            else:
+                self.groups[vals] = value
+
+    def rows(self):
+        result = []
+        for vals in sort_group_keys(self.groups, [s for k, s in self.group_args]):
+            d = SequenceDict()
+            for k, v in zip(self.keys, vals):
+                d[k] = v
+            self.fill(d, self.groups[vals])
+            result.append(d)
+        return result
 
 
-@Dictionary.project("number", Dictionary)
-def __dictionary_float(self, arg, error, **kwargs):
-    try:
-        d = SequenceDict()
-        int_keys = arg.split()
-        for k in self:
-            d[k] = self[k]
-            if k in int_keys:
-                d[k] = float(d[k])
-        return d
-    except KeyError or ValueError:
-        error("Invalid argument")
+class Count(Aggregate):
+    def parse(self, arg, error):
+        self.name = arg or "count"
 
+    def new(self):
+        return 0
 
-@Dictionary.project("rename", Dictionary)
-def __dictionary_rename(self, arg, error, **kwargs):
-    if not arg:
-        error("Invalid argument")
-    args = arg.split()
-    if len(args) != 2:
-        error("Invalid argument")
-    old_key, new_key = args
-    if old_key not in self:
-        error("Invalid argument")
-    elif new_key in self:
-        error("Invalid argument")
-    d = SequenceDict()
-    for key in self:
-        if key == old_key:
-            d[new_key] = self[old_key]
-        else:
-            d[key] = self[key]
-    return d
+    def add(self, value, item):
+        return value + 1
 
+    def combine(self, value, other):
+        return value + other
 
-class Group(Handler):
-    def __init__(self, *keys):
-        self.__keys = list(keys)
-        key = self.__keys.pop(0)
-        if isinstance(key, list) or isinstance(key, tuple):
-            self.__key, self.__sort = key
-        else:
-            self.__key, self.__sort = key, None
+    def fill(self, d, value):
+        d[self.name] = value
 
-        self.__items = SortedDict(self.__sort)
 
-    def __repr__(self):
-        def __formatter(k, s):
-            if s is None:
-                return k
-            else:
-                return k + " " + s
+class Sum(Aggregate):
+    def parse(self, arg, error):
+        if not arg:
+            error("No argument given")
+        self.sum_keys = arg.split()
 
-        result = "Group ["
-        result += __formatter(self.__key, self.__sort)
-        for k, s in self.__keys:
-            result += ", "
-            result += __formatter(k, s)
-        result += "]"
-        return result
+    def new(self):
+        return [0] * len(self.sum_keys)
 
-    def __iter(self, *kvs):
-        kvs = list(kvs)
-        if self.__keys:
-            for val in self.__items:
-                for i in self[val].__iter(*(kvs + [(self.__key, val)])):
-                    yield i
-        else:
-            for val in self.__items:
-                yield (kvs + [(self.__key, val)], self[val])
+    def add(self, value, item):
+        for i, k in enumerate(self.sum_keys):
+            value[i] += item[k]
+        return value
 
-    def __iter__(self):
-        for kvs, l in self.__iter():
-            for item in l:
-                yield item
+    def combine(self, value, other):
+        return [a + b for a, b in zip(value, other)]
 
-    def __getitem__(self, item):
-        return self.__items.__getitem__(item)
+    def fill(self, d, value):
+        for k, v in zip(self.sum_keys, value):
+            d[k] = v
 
-    def __setitem__(self, key, value):
-        return self.__items.__setitem__(key, value)
 
-    def append(self, item):
-        val = item[self.__key]
-        if val not in self.__items:
-            if self.__keys:
-                self[val] = Group(*self.__keys)
-            else:
-                self[val] = []
-        self[val].append(item)
+class CountDistinct(Aggregate):
+    def parse(self, arg, error):
+        args = arg.split()
+        if len(args) not in [1, 2]:
+            error("Invalid argument")
+        self.key = args[0]
+        try:
+            self.precision = int(args[1]) if len(args) == 2 else 12
+            HyperLogLog(self.precision)
+        except ValueError:
+            error("Invalid argument")
 
-    def un_group(self, **kwargs):
-        a = List(Dictionary)(self)
-        return a
+    def new(self):
+        return HyperLogLog(self.precision)
 
-    def __new_group(self, converter=None, l_converter=None):
-        group = Group((self.__key, self.__sort), *self.__keys)
+    def add(self, value, item):
+        value.add(item[self.key])
+        return value
 
-        if l_converter is not None:
-            for kvs, l in self.__iter():
-                group.append(l_converter(kvs, l))
-        elif converter is not None:
-            for kvs, l in self.__iter():
-                for item in l:
-                    group.append(converter(kvs, item))
-        else:
-            raise ValueError
+    def combine(self, value, other):
+        value.merge(other)
+        return value
 
-        return group
+    def fill(self, d, value):
+        d[self.key] = value.estimate()
 
-    def add_count(self, arg, **kwargs):
-        if not arg:
-            arg = "count"
 
-        def __add_count(kvs, item):
-            result = item._item.copy()
-            result[arg] = 1
-            return result
+AGGREGATES = {
+    "count": Count,
+    "sum": Sum,
+    "count-distinct": CountDistinct,
+}
 
-        return self.__new_group(converter=__add_count)
 
-    def count(self, arg, **kwargs):
-        if not arg:
-            arg = "count"
+def split_ranges(name, size, n):
+    """
+    Split a file into at most `n` ranges of whole lines.
 
-        def __count(kvs, l):
-            keys = []
-            values = []
-            for k, v in kvs:
-                keys.append(k)
-                values.append(v)
-            keys.append(arg)
-            values.append(len(l))
-            return SequenceDict(keys, values)
+    :return: A list of (start, stop) byte offsets
+    """
+    bounds = [0]
+    with open(name, "rb") as f:
+        for i in range(1, n):
+            f.seek(size * i // n - 1)
+            f.readline()
+            bound = min(f.tell(), size)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def __init_worker():
+    # Ctrl-C is handled by the main process, which stops waiting for the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def __work(task):
+    console_type, name, start, stop, lines, aggregate = task
+    console = console_type(clear=False, out=io.StringIO())
+    console.result = OpenedFile(name, start, stop)
+    try:
+        for cmd, arg in lines:
+            console.single_line(cmd, arg)
+        aggregate.add_all(console.result)
+    except KeyError:
+        raise Error("Invalid argument")
+    finally:
+        if isinstance(console.result, Iterator):
+            console.result.exit()
+    return aggregate
 
-        return self.__new_group(l_converter=__count)
 
-    def sum(self, arg, error, **kwargs):
-        if not arg:
-            error("No argument given")
-        sum_keys = arg.split()
+def aggregate(console_type, last, lineage, workers, cmd, arg, error, interrupt=None):
+    """
+    Compute an aggregate of a result read from a file, in `workers` processes.
 
-        def __sum(kvs, l):
-            keys = []
-            values = []
-            for k, v in kvs:
-                keys.append(k)
-                values.append(v)
-            keys.extend(sum_keys)
-            for key in sum_keys:
-                val = 0
-                for item in l:
-                    val += item[key]
-                values.append(val)
-            return SequenceDict(keys, values)
+    Each process reads a part of the file, repeats the commands in `lineage` on it,
+    and aggregates its entries. The aggregates are then merged in the order of the parts.
 
-        return self.__new_group(l_converter=__sum)
+    :param console_type: Creates the consoles of the processes
+    :param last: The result
+    :param lineage: The lineage of the result, see `cache.next_lineage`
+    :param interrupt: If requested, stop after the next part, and return the aggregate of the parts so far
+    """
+    if not isinstance(last, Collection) or last._type is not Dictionary:
+        error("`parallel` can only apply to List or Iter of Dictionary")
+    if cmd not in AGGREGATES:
+        error("Only {} can run in parallel".format(", ".join(sorted(AGGREGATES))))
+    result = AGGREGATES[cmd](arg, error)
+    if lineage is None or len(lineage) < 2:
+        error("`parallel` can only apply to the result of reading a file")
+    identity = lineage[0]
+    lines = []
+    for line in lineage[1:]:
+        args = line.split(None, 1)
+        lines.append((args[0], args[1] if len(args) > 1 else None))
+    if lines[0][0] not in READERS:
+        error("`parallel` can only apply to the result of reading a file")
+    for c, a in lines[1:]:
+        if c not in ROW_LOCAL:
+            error("`{}` cannot run in parallel".format(c))
+    if file_identity(identity[0]) != identity:
+        error("File '{}' has been modified".format(identity[0]))
+
+    name, size = identity[0], identity[1]
+    n = max(1, min(workers * RANGES_PER_WORKER, size // MIN_RANGE))
+    tasks = [(console_type, name, start, stop, lines, AGGREGATES[cmd](arg, error))
+             for start, stop in split_ranges(name, size, n)]
+    if tasks:
+        with multiprocessing.Pool(min(workers, len(tasks)), __init_worker) as pool:
+            for partial in pool.imap(__work, tasks):
+                result.merge(partial)
+                if interrupt is not None and interrupt.requested:
+                    break
+    return List(Dictionary)(result.rows())
 
 
 # --- command.py ---
@@ -819,10 +2650,19 @@ def command(name):
     return __decor
 
 
-def execute(name, **kwargs):
-    if name not in __commands:
-        raise Error("Command '{}' not found".format(name))
-    return __commands[name](cmd=name, **kwargs)
+def get(name):
+    """
+    Get the function of a command, or None if not found.
+    """
+    return __commands.get(name)
+
+
+def execute(name, func=None, **kwargs):
+    if func is None:
+        if name not in __commands:
+            raise Error("Command '{}' not found".format(name))
+        func = __commands[name]
+    return func(cmd=name, **kwargs)
 
 
 # -----
@@ -856,9 +2696,7 @@ def __cmd_run(arg, error, console, **kwargs):
     if not arg:
         error("Please specify a script")
     try:
-        with open(arg) as f:
-            for line in f:
-                console.line(line)
+        console.run(arg)
     except FileNotFoundError:
         error("File '{}' does not exist".format(arg))
     except IsADirectoryError:
@@ -867,6 +2705,73 @@ def __cmd_run(arg, error, console, **kwargs):
         return console.result
 
 
+@command("profile")
+def __cmd_profile(arg, error, last, console, **kwargs):
+    if arg == "on":
+        console.profile(True)
+    elif arg == "off":
+        console.profile(False)
+    else:
+        error("Please specify 'on' or 'off'")
+    return last
+
+
+@command("progress")
+def __cmd_progress(arg, error, last, console, **kwargs):
+    if arg == "on":
+        console.show_progress = True
+    elif arg == "off":
+        console.show_progress = False
+    else:
+        error("Please specify 'on' or 'off'")
+    return last
+
+
+@command("cache")
+def __cmd_cache(arg, last, console, **kwargs):
+    console.set_cache(arg)
+    return last
+
+
+MEM_SAMPLE = 10000
+
+
+@command("mem")
+def __cmd_mem(arg, error, last, console, **kwargs):
+    if arg:
+        try:
+            threshold = int(arg)
+        except ValueError:
+            error("Invalid argument")
+        if threshold < 0:
+            error("Invalid argument")
+        STRINGS.threshold = threshold
+
+    def __report(name, value):
+        if isinstance(value, List) and len(value):
+            size, pooled = value.memory(MEM_SAMPLE)
+            console.output("{}: {!r}  {:.1f} bytes/row  {} of strings pooled".format(
+                name, value, size / len(value), "-" if pooled is None else "{:.1%}".format(pooled)))
+        else:
+            console.output("{}: {!r}".format(name, value))
+
+    __report("(result)", last)
+    for name in sorted(console.stored_values):
+        __report(name, console.stored_values[name])
+    console.output(repr(STRINGS))
+    return last
+
+
+@command("parallel")
+def __cmd_parallel(arg, console, **kwargs):
+    return console.parallel(arg)
+
+
+@command("tee")
+def __cmd_tee(arg, console, **kwargs):
+    return console.tee(arg)
+
+
 @command("-")
 def __cmd_sep(last, console, **kwargs):
     console.output("")
@@ -876,7 +2781,11 @@ def __cmd_sep(last, console, **kwargs):
 @command("close")
 @command("read-lines")
 @command("read-by-line")
+@command("read-format")
+@command("read-bytes")
+@command("decode")
 @command("split")
+@command("parse")
 @command("make-dict")
 @command("print")
 @command("save")
@@ -898,7 +2807,16 @@ def __cmd_sep(last, console, **kwargs):
 @command("count")
 @command("add-count")
 @command("sum")
+@command("count-distinct")
+@command("join")
+@command("left-join")
+@command("dedup")
+@command("dedup-bloom")
+@command("sample")
+@command("sample-rate")
 @command("rename")
+@command("bucket")
+@command("infer-types")
 def __cmd_common(last, error, **kwargs):
     if last is None:
         error("Nothing to operate")
@@ -908,63 +2826,442 @@ def __cmd_common(last, error, **kwargs):
 @command("load")
 def __cmd_load(arg, error, console, **kwargs):
     if arg in console.stored_values:
-        return console.stored_values[arg]
+        value = console.stored_values[arg]
+        if isinstance(value, Cache):
+            return value.load(arg, error)
+        return value
     else:
         error("Value '{}' not found".format(arg))
 
 
+# --- server.py ---
+
+END = "\0"
+
+
+def serve(path, console_type):
+    """
+    Accept command lines over a Unix socket at `path`, until interrupted.
+
+    Each client gets its own console, and all consoles share stored values and cached results.
+    Lines are executed one at a time across all clients. The output of each line
+    is sent back, followed by a line of `END`.
+    """
+    stored_values = {}
+    cache = ResultCache()
+
+    def __new_console(out):
+        return console_type(clear=False, out=out, stored_values=stored_values, cache=cache)
+
+    def __execute(console, line):
+        """
+
+        :return: The console for the next line, or None if the client exits
+        """
+        try:
+            console.line(line)
+        except ResetCommand:
+            return __new_console(console.out)
+        except ExitCommand:
+            return None
+        console.report()
+        console.print()
+        return console
+
+    async def __serve():
+        lock = asyncio.Lock()
+        loop = asyncio.get_event_loop()
+
+        async def __session(reader, writer):
+            out = io.StringIO()
+            console = __new_console(out)
+            try:
+                while console is not None:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    async with lock:
+                        console = await loop.run_in_executor(
+                            None, __execute, console, line.decode())
+                    reply = out.getvalue()
+                    if console is not None:
+                        reply += END + "\n"
+                    out.seek(0)
+                    out.truncate()
+                    writer.write(reply.encode())
+                    await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(__session, path)
+        print("\033[1;32mListening on {}\033[0m".format(path))
+        async with server:
+            await server.serve_forever()
+
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+    try:
+        asyncio.run(__serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+# --- client.py ---
+
+def connect(path, script=None):
+    """
+    Send command lines to a program started with `--serve`, and print its output.
+
+    Lines are read from `script` if given, or else from the user.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    f = sock.makefile("rw", encoding="utf-8", newline="\n")
+
+    def __send(line):
+        """
+
+        :return: False if the server closed the connection
+        """
+        f.write(line.rstrip("\n") + "\n")
+        f.flush()
+        for reply in f:
+            if reply.endswith(END + "\n"):
+                sys.stdout.write(reply[:-len(END) - 1])
+                sys.stdout.flush()
+                return True
+            sys.stdout.write(reply)
+        return False
+
+    try:
+        if script is not None:
+            with open(script) as lines:
+                for line in lines:
+                    if not __send(line):
+                        break
+        else:
+            while True:
+                try:
+                    line = input("> ")
+                except EOFError:
+                    break
+                if not __send(line):
+                    break
+    finally:
+        f.close()
+        sock.close()
+
+
+
 # --- main.py ---
 
 class Console(object):
-    def __init__(self):
-        clear_screen()
+    def __init__(self, clear=True, out=None, stored_values=None, cache=None):
+        """
+
+        :param clear: Clear the screen
+        :param out: The file to write output to (default: stdout)
+        :param stored_values: Share stored values with other consoles
+        :param cache: Share the result cache with other consoles
+        """
+        if clear:
+            clear_screen()
+        self.out = out
         self.result = None
-        self.stored_values = {}
+        self.lineage = None
+        self.stored_values = {} if stored_values is None else stored_values
+        self.cache = ResultCache() if cache is None else cache
+        self.profiler = None
+        self.show_progress = out is None and sys.stderr.isatty()
+        self.interrupt = Interrupt()
+
+    def single_line(self, cmd, arg=None, func=None):
+        lineage = next_lineage(self.lineage, cmd, arg)
+
+        def __execute():
+            return execute(
+                cmd,
+                func=func,
+                arg=arg,
+                last=self.result,
+                console=self,
+                error=self.error
+            )
+
+        if self.profiler is None:
+            self.result = __execute()
+        else:
+            self.result = self.profiler.command(cmd, arg, self.result, __execute)
 
-    def single_line(self, line):
-        if not line:
+        if self.interrupt.requested:
+            # The result may be partial, so it is not cached
+            self.lineage = None
             return
-        try:
-            cmd, arg = line.split(None, 1)
-        except ValueError:
-            cmd, arg = line, None
-        self.result = execute(
-            cmd,
-            arg=arg,
-            last=self.result,
-            console=self,
-            error=self.error
-        )
+        self.lineage = lineage if self.result is not None else None
+        if lineage is not None and isinstance(self.result, List) and self.cache.capacity:
+            self.cache.put(lineage, self.result, self.result.nbytes())
+
+    def resume(self, lines):
+        """
+        Skip the longest prefix of `lines` whose result is cached, and make it the current result.
+
+        :return: The lines left to execute
+        """
+        if not self.cache.capacity:
+            return lines
+        lineage = self.lineage
+        skip = 0
+        for i, line in enumerate(lines):
+            if line.cmd in PASS_THROUGH:
+                break
+            lineage = next_lineage(lineage, line.cmd, line.arg)
+            if lineage is None:
+                break
+            if lineage in self.cache:
+                skip = i + 1
+                found = lineage
+        if not skip:
+            return lines
+        self.result = self.cache.get(found)
+        self.lineage = found
+        return lines[skip:]
 
     def line(self, line):
         MultiLineGroup(line).execute(self)
 
+    def interruptible(self, line):
+        """
+        Execute a line, where Ctrl-C stops reading the file and keeps the partial result.
+        """
+        with self.interrupt:
+            self.line(line)
+        if self.interrupt.rows is not None:
+            self.message("Interrupted after {} rows, the result is partial".format(self.interrupt.rows))
+        elif self.interrupt.requested:
+            self.message("Interrupted, the result may be partial")
+
+    def run(self, name):
+        for line in compile_script(name):
+            if self.interrupt.requested:
+                break
+            line.execute(self)
+
+    def tee(self, arg):
+        """
+        Iterate the current result once, feeding each entry to several branches.
+
+        :param arg: "NAME1: CMD |> CMD ... || NAME2: CMD |> CMD ..."
+        :return: The current result if it is a List, or None if it was an Iter, which is used up
+        """
+        source = self.result
+        if not isinstance(source, Collection):
+            self.error("`tee` can only apply to List or Iter")
+        if not arg:
+            self.error("Invalid argument")
+        branches = []
+        for branch in arg.split("||"):
+            name, sep, commands = branch.partition(":")
+            name = name.strip()
+            if not sep or not name or len(name.split()) != 1:
+                self.error("Invalid argument")
+            branches.append(Branch(self, source._type, name, commands.split("|>")))
+
+        def __send(chunk):
+            for b in branches:
+                b.send(chunk)
+
+        for b in branches:
+            b.start()
+        try:
+            chunk = []
+            for item in source:
+                chunk.append(item)
+                if len(chunk) >= Collection.BATCH_SIZE:
+                    __send(chunk)
+                    chunk = []
+                    if all(b.done.is_set() for b in branches):
+                        break
+            if chunk:
+                __send(chunk)
+            __send(None)
+        finally:
+            if isinstance(source, Iterator):
+                source.exit()
+            for b in branches:
+                b.stop()
+
+        for b in branches:
+            if b.error is not None:
+                self.show_error("{}: {}".format(b.name, b.error))
+            elif b.result is not None:
+                self.stored_values[b.name] = b.result
+        self.message("Stored{}: {}".format(
+            " (partial)" if self.interrupt.requested else "",
+            ", ".join(b.name for b in branches if b.name in self.stored_values and b.error is None)))
+        if isinstance(source, Iterator):
+            return None
+        return source
+
+    def parallel(self, arg):
+        """
+        :param arg: "[WORKERS] CMD ARG"
+        """
+        args = arg.split(None, 1) if arg else []
+        workers = os.cpu_count() or 1
+        if args and args[0].isdigit():
+            workers = int(args[0])
+            args = args[1].split(None, 1) if len(args) > 1 else []
+        if len(args) != 2 or workers <= 0:
+            self.error("Invalid argument")
+        result = aggregate(Console, self.result, self.lineage, workers, args[0], args[1], self.error,
+                           self.interrupt)
+        if isinstance(self.result, Iterator):
+            self.result.exit()
+        return result
+
+    def set_cache(self, arg):
+        """
+        :param arg: None to show the cache, "clear", or the capacity in MB (0 disables it)
+        """
+        if not arg:
+            self.message(repr(self.cache))
+        elif arg == "clear":
+            self.cache.clear()
+        else:
+            try:
+                capacity = float(arg)
+            except ValueError:
+                self.error("Invalid argument")
+            if capacity < 0:
+                self.error("Invalid argument")
+            self.cache.resize(int(capacity * 1024 * 1024))
+
+    def profile(self, on):
+        if on and self.profiler is None:
+            self.profiler = Profiler()
+        elif not on and self.profiler is not None:
+            self.profiler.report(self)
+            self.profiler = None
+
+    def new_progress(self, size):
+        """
+        :return: A progress line of reading `size` bytes, or None if progress is not shown
+        """
+        if not self.show_progress:
+            return None
+        return Progress(size)
+
+    def report(self):
+        if self.profiler is not None:
+            self.profiler.report(self)
+
     def exit(self):
         raise ExitCommand
 
     def reset(self):
+        STRINGS.clear()
         raise ResetCommand
 
     def error(self, message):
         raise Error(message)
 
     def output(self, message):
-        print(message)
+        print(message, file=self.out)
+
+    def output_lines(self, lines):
+        """
+        Print lines in blocks, with one write for each block.
+        """
+        out = self.out if self.out is not None else sys.stdout
+        block = []
+        for line in lines:
+            block.append(line)
+            if len(block) >= OUTPUT_BLOCK:
+                block.append("")
+                out.write("\n".join(block))
+                block = []
+        if block:
+            block.append("")
+            out.write("\n".join(block))
+        out.flush()
+
+    def page(self, lines):
+        """
+        Print lines one screen at a time, asking before each next screen.
+
+        Lines are only formatted when shown. Everything is printed at once if not on a terminal.
+        """
+        if self.out is not None or not sys.stdout.isatty():
+            self.output_lines(lines)
+            return
+        size = max(shutil.get_terminal_size().lines - 1, 1)
+        lines = iter(lines)
+        while True:
+            screen = []
+            for line in lines:
+                screen.append(line)
+                if len(screen) >= size:
+                    break
+            self.output_lines(screen)
+            if len(screen) < size:
+                return
+            if input("-- More (Enter: next page, q: quit) --").strip().lower() == "q":
+                return
 
     def message(self, message):
-        print("\033[1;32m" + message + "\033[0m")
+        print("\033[1;32m" + message + "\033[0m", file=self.out)
+
+    def show_error(self, message):
+        print("\033[1;31m" + message + "\033[0m", file=self.out)
 
     def print(self):
         if self.result is not None:
-            print("\033[1;36m" + repr(self.result) + "\033[0m")
+            print("\033[1;36m" + repr(self.result) + "\033[0m", file=self.out)
+
+
+OUTPUT_BLOCK = 4096
+
+
+class StreamConsole(Console):
+    """
+    A console in a shell pipeline: results go to `out`, messages go to stderr without colors.
+    """
+
+    def __init__(self, out):
+        Console.__init__(self, clear=False, out=out)
+        self.failed = False
+        self.last_cmd = None
+
+    def single_line(self, cmd, arg=None, func=None):
+        Console.single_line(self, cmd, arg, func)
+        self.last_cmd = cmd
+
+    def message(self, message):
+        print(message, file=sys.stderr)
+
+    def show_error(self, message):
+        self.failed = True
+        print(message, file=sys.stderr)
+
+    def print(self):
+        pass
 
 
 class SingleLine(object):
     def __init__(self, line):
-        self.line = line.strip()
+        line = line.strip()
+        try:
+            self.cmd, self.arg = line.split(None, 1)
+        except ValueError:
+            self.cmd, self.arg = line, None
+        self.func = get(self.cmd)
 
     def execute(self, console):
-        console.single_line(self.line)
+        if self.cmd:
+            console.single_line(self.cmd, self.arg, self.func)
 
 
 class MultiLine(object):
@@ -973,12 +3270,85 @@ class MultiLine(object):
 
     def execute(self, console):
         try:
-            for l in self.lines:
+            for l in console.resume(self.lines):
+                if console.interrupt.requested:
+                    break
                 l.execute(console)
+        except (ExitCommand, ResetCommand):
+            raise
+        except Error as e:
+            console.show_error(e.msg)
+        except KeyboardInterrupt:
+            if not console.interrupt.requested:
+                raise
+            # Ctrl-C pressed again before reading stopped: drop the unfinished `Iter`, and close its file
+            if isinstance(console.result, Iterator):
+                console.result.exit()
+                console.result = None
+                console.lineage = None
+            console.interrupt.rows = None
+        except Exception as e:
+            console.show_error("Unhandled exception: {}".format(e))
+
+
+class Branch(object):
+    """
+    A pipeline of `tee`, executed in its own thread on the entries sent to it.
+    """
+    QUEUE_DEPTH = 4
+
+    def __init__(self, console, type, name, lines):
+        self.name = name
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.__lines = [SingleLine(l) for l in lines]
+        self.__queue = queue.Queue(Branch.QUEUE_DEPTH)
+        self.__console = Console(clear=False, out=console.out, stored_values=console.stored_values)
+        self.__console.result = Iterator(type, lambda: None)(self.__receive)
+        self.__console.interrupt = console.interrupt
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+
+    def __receive(self):
+        while True:
+            chunk = self.__queue.get()
+            if chunk is None:
+                return
+            for item in chunk:
+                yield item
+
+    def __run(self):
+        try:
+            for line in self.__lines:
+                line.execute(self.__console)
+            self.result = self.__console.result
+            if isinstance(self.result, Iterator):
+                self.result = self.result.do()
         except Error as e:
-            print("\033[1;31m" + e.msg + "\033[0m")
+            self.error = e.msg
         except Exception as e:
-            print("\033[1;31mUnhandled exception: {}\033[0m".format(e))
+            self.error = "Unhandled exception: {}".format(e)
+        finally:
+            self.done.set()
+
+    def start(self):
+        self.__thread.start()
+
+    def send(self, chunk):
+        """
+        Send a list of entries, or None when there are no more. Ignored if the branch has finished.
+        """
+        while not self.done.is_set():
+            try:
+                self.__queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def stop(self):
+        self.send(None)
+        self.__thread.join()
 
 
 class MultiLineGroup(object):
@@ -989,32 +3359,109 @@ class MultiLineGroup(object):
 
     def execute(self, console):
         for l in self.lines:
+            if console.interrupt.requested:
+                break
             l.execute(console)
 
 
+__scripts = {}
+
+
+def compile_script(name):
+    """
+    Parse a script into a list of `MultiLineGroup`.
+
+    Parsed scripts are cached by path, and reused as long as the file is not modified.
+    """
+    path = os.path.abspath(name)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if path in __scripts and __scripts[path][0] == version:
+        return __scripts[path][1]
+    with open(path) as f:
+        script = [MultiLineGroup(line) for line in f]
+    __scripts[path] = (version, script)
+    return script
+
+
 def main():
     console = Console()
     while True:
         try:
             line = input("> ")
-            console.line(line)
+            console.interruptible(line)
         except ResetCommand:
             console = Console()
             continue
         except ExitCommand:
             break
+        console.report()
         console.print()
 
 
-def script(name):
+def script(name, profile=False):
     console = Console()
-    console.line("run " + name)
+    console.profile(profile)
+    try:
+        console.interruptible("run " + name)
+    except (ExitCommand, ResetCommand):
+        pass
+    console.report()
 
 
-if __name__ == "__main__":
-    from sys import argv
+STREAM_BUFFER = 1024 * 1024
+
+
+def stream(line):
+    """
+    Execute a line on the lines of stdin, and write the result to stdout.
+
+    :return: Exit status
+    """
+    out = io.open(sys.stdout.fileno(), "w", buffering=STREAM_BUFFER, closefd=False)
+    console = StreamConsole(out)
+    console.result = Iterator(Line, lambda: None)(lambda: sys.stdin)
+    try:
+        try:
+            console.line(line)
+        except (ExitCommand, ResetCommand):
+            pass
+        if console.failed:
+            return 1
+        # A pipeline ending in `print` has written its result already
+        if console.last_cmd != "print" and isinstance(console.result, (Collection, Group)):
+            console.output_lines(str(item) for item in console.result)
+        out.flush()
+    except BrokenPipeError:
+        # The reader went away (e.g. `head`); silence the final flush of stdout
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    return 0
 
-    if len(argv) <= 1:
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("script", nargs="?",
+                        help="execute a script instead of entering interactive mode")
+    parser.add_argument("--profile", action="store_true",
+                        help="print a cost table for every command when the script ends")
+    parser.add_argument("-e", dest="line", metavar="COMMANDS",
+                        help="execute commands on the lines of stdin, and write the result to stdout")
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="keep running and accept commands over a Unix socket")
+    parser.add_argument("--connect", metavar="SOCKET",
+                        help="send commands to a program started with --serve")
+    args = parser.parse_args()
+
+    if args.line is not None:
+        sys.exit(stream(args.line))
+    elif args.serve is not None:
+        serve(args.serve, Console)
+    elif args.connect is not None:
+        connect(args.connect, args.script)
+    elif args.script is None:
         main()
     else:
-        script(argv[1])
+        script(args.script, profile=args.profile)
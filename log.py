@@ -1,9 +1,16 @@
+import codecs as _codecs
+import io as _io
+import json as _json
+import math as _math
 import os as _os
+import queue as _queue
+import random as _random
 import re as _re
+import sys as _sys
+import threading as _threading
 
 from mklibpy.common.collection import SequenceDict as _SequenceDict
 from mklibpy.util.collection import format_list as _format_list, format_dict as _format_dict
-from mklibpy.util.collection import to_dict as _to_dict
 
 import util as _util
 
@@ -14,6 +21,10 @@ class HandlerMethodNotFound(_util.Error):
     pass
 
 
+# Strings shared by entries read from files
+STRINGS = _util.StringPool()
+
+
 class Handler(object):
     @classmethod
     def get_handler_method(cls, cmd):
@@ -30,20 +41,145 @@ class Handler(object):
         return self.__class__.__name__
 
 
+class ReadAhead(object):
+    """
+    Read a file in blocks in a background thread, and split the blocks into lines.
+
+    At most `depth` blocks are read ahead of the lines consumed.
+    """
+
+    def __init__(self, file, depth, block):
+        self.depth = depth
+        self.block = block
+        self.blocks = 0
+        self.max_queued = 0
+        self.waits = 0
+        self.__file = file
+        self.__queue = _queue.Queue(depth)
+        self.__stop = _threading.Event()
+        self.__thread = _threading.Thread(target=self.__read)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __repr__(self):
+        return "read-ahead depth={} block={} blocks={} max-queued={} waits={}".format(
+            self.depth, self.block, self.blocks, self.max_queued, self.waits)
+
+    def __put(self, data):
+        while not self.__stop.is_set():
+            try:
+                self.__queue.put(data, timeout=0.1)
+                return True
+            except _queue.Full:
+                pass
+        return False
+
+    def __read(self):
+        try:
+            while True:
+                data = self.__file.read(self.block)
+                if not self.__put(data) or not data:
+                    return
+        except Exception as e:
+            self.__put(e)
+
+    def __iter__(self):
+        rest = ""
+        while True:
+            if self.__queue.empty():
+                self.waits += 1
+            data = self.__queue.get()
+            self.max_queued = max(self.max_queued, self.__queue.qsize() + 1)
+            if isinstance(data, Exception):
+                raise data
+            if not data:
+                break
+            self.blocks += 1
+            lines = (rest + data).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line
+        if rest:
+            yield rest
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+
+class ByteRange(_io.RawIOBase):
+    """
+    The bytes of a file from `start` to `stop`.
+    """
+
+    def __init__(self, name, start, stop):
+        _io.RawIOBase.__init__(self)
+        self.__file = open(name, "rb", buffering=0)
+        self.__file.seek(start)
+        self.__start = start
+        self.__left = stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.__left)
+        if n <= 0:
+            return 0
+        data = self.__file.read(n)
+        b[:len(data)] = data
+        self.__left -= len(data)
+        return len(data)
+
+    def tell(self):
+        return self.__file.tell() - self.__start
+
+    def close(self):
+        self.__file.close()
+        _io.RawIOBase.close(self)
+
+
 class OpenedFile(Handler):
     BY_LINE_THRESHOLD = 1024 * 1024
+    READ_AHEAD_DEPTH = 8
+    READ_AHEAD_BLOCK = 1024 * 1024
+    CHECK_ROWS = 1024
 
-    def __init__(self, name):
+    def __init__(self, name, start=None, stop=None):
+        """
+
+        :param start: Only read from this byte, which should be the start of a line
+        :param stop: Only read up to this byte, which should be the end of a line
+        """
         if not name or not isinstance(name, str):
             raise ValueError
         self.__name = name
-        self.__file = open(name)
-        self.__size = _os.path.getsize(name)
+        if start is None:
+            self.__file = open(name)
+            self.__size = _os.path.getsize(name)
+        else:
+            self.__file = _io.TextIOWrapper(_io.BufferedReader(ByteRange(name, start, stop)))
+            self.__size = stop - start
+        self.__read = 0
+        self.__progress = None
+        self.read_ahead = None
 
     def __repr__(self):
         return "OpenedFile '{}' {} bytes".format(self.__name, self.__size)
 
+    @property
+    def bytes_read(self):
+        if self.__file.closed:
+            return self.__read
+        return self.__file.buffer.tell()
+
     def close(self, **kwargs):
+        if self.read_ahead is not None:
+            self.read_ahead.stop()
+        if self.__progress is not None:
+            self.__progress.clear()
+        if not self.__file.closed:
+            self.__read = self.__file.buffer.tell()
         self.__file.close()
 
     def read_lines(self, console, **kwargs):
@@ -56,18 +192,105 @@ class OpenedFile(Handler):
             self.close(console=console, **kwargs)
             return lines
 
-    def read_by_line(self, **kwargs):
+    def __tracked(self, items, console):
+        """
+        Iterate `items` while reading the file, showing the progress on `console`,
+        and closing the file at a row boundary when `console` is interrupted.
+
+        Both are only checked every `CHECK_ROWS` rows.
+        """
+        if console is None:
+            return items
+        self.__progress = console.new_progress(self.__size)
+        progress = self.__progress
+        interrupt = console.interrupt
+
         def __iter():
-            for line in self.__file:
+            rows = 0
+            for item in items:
+                yield item
+                rows += 1
+                if not rows % OpenedFile.CHECK_ROWS:
+                    if interrupt.requested:
+                        interrupt.rows = rows
+                        self.close()
+                        break
+                    if progress is not None:
+                        progress.update(self.bytes_read, rows)
+            if progress is not None:
+                progress.clear()
+
+        return __iter()
+
+    def read_by_line(self, arg=None, error=None, console=None, **kwargs):
+        if arg:
+            args = arg.split()
+            if args[0] != "prefetch" or len(args) > 3:
+                error("Invalid argument")
+            try:
+                depth = int(args[1]) if len(args) > 1 else OpenedFile.READ_AHEAD_DEPTH
+                block = int(args[2]) if len(args) > 2 else OpenedFile.READ_AHEAD_BLOCK
+            except ValueError:
+                error("Invalid argument")
+            if depth <= 0 or block <= 0:
+                error("Invalid argument")
+        else:
+            depth = None
+
+        def __iter():
+            if depth is None:
+                lines = self.__file
+            else:
+                self.read_ahead = ReadAhead(self.__file, depth, block)
+                lines = self.read_ahead
+            for line in self.__tracked(lines, console):
                 yield line
 
         def __exit():
-            self.close(**kwargs)
+            self.close(arg=arg, error=error, console=console, **kwargs)
 
         return Iterator(Line, __exit)(__iter)
 
+    def read_bytes(self, arg, error, console=None, **kwargs):
+        if arg:
+            error("Invalid argument")
+
+        def __iter():
+            for line in self.__tracked(self.__file.buffer, console):
+                yield line
+
+        def __exit():
+            self.close(arg=arg, error=error, console=console, **kwargs)
+
+        return Iterator(BytesLine, __exit)(__iter)
+
+    def read_format(self, arg, error, console=None, **kwargs):
+        if arg not in READ_FORMATS:
+            error("Please specify a format: {}".format(", ".join(sorted(READ_FORMATS))))
+        parse = READ_FORMATS[arg]
+
+        def __iter():
+            lines = []
+            for line in self.__tracked(self.__file, console):
+                lines.append(line)
+                if len(lines) >= Collection.BATCH_SIZE:
+                    for item in parse(lines):
+                        yield item
+                    lines = []
+            if lines:
+                for item in parse(lines):
+                    yield item
+
+        def __exit():
+            self.close(arg=arg, error=error, console=console, **kwargs)
+
+        return Iterator(Dictionary, __exit)(__iter)
+
 
 class Collection(Handler):
+    BATCH_SIZE = 4096
+    INFER_SAMPLE = 1000
+
     def __init__(self, type):
         self._type = type
 
@@ -87,19 +310,30 @@ class Collection(Handler):
     def _get_items(self, type, converter, match):
         pass
 
+    def _get_batches(self, type, func):
+        """
+
+        :param func: Converts a list of item contents into a list of projected item contents
+        """
+        pass
+
     def execute_cmd(self, cmd, **kwargs):
         arg = kwargs["arg"]
-        if arg and "@" in arg and cmd != "group":
+        if arg and "@" in arg and cmd not in ["group", "count-distinct", "join", "left-join"]:
             arg1, arg2 = [a.strip() for a in arg.rsplit("@", 1)]
-            console = kwargs["console"]
-            if cmd == "sort":
-                line = "group @ {} && un-group".format(arg2)
-            else:
-                line = "group @ {} && {} {} && un-group".format(arg2, cmd, arg1)
-            console.line(line)
-            return console.result
+            kwargs = {k: v for k, v in kwargs.items() if k != "arg"}
+            group = self.execute_cmd(cmd="group", arg="@ " + arg2, **kwargs)
+            if cmd != "sort":
+                group = group.execute_cmd(cmd=cmd, arg=arg1, **kwargs)
+            return group.execute_cmd(cmd="un-group", arg=None, **kwargs)
         elif cmd in self._type.PROJECTED_TYPE:
             projected_type = self._type.PROJECTED_TYPE[cmd]
+            method = self._type.get_handler_method(cmd)
+            if hasattr(method, "batch"):
+                arg = method.parse(arg, kwargs["error"])
+                kwargs = {k: v for k, v in kwargs.items() if k != "arg"}
+                return self._get_batches(projected_type,
+                                         lambda items: method.batch(items, arg, **kwargs))
             return self.get_items(projected_type,
                                   converter=lambda item: item.execute_cmd(cmd=cmd, **kwargs))
         else:
@@ -112,12 +346,13 @@ class Collection(Handler):
     def keep(self, arg, error, **kwargs):
         if not arg:
             error("Please specify criteria")
-        return self.get_items(self._type, match=lambda item: item.match(arg))
+        return self.get_items(self._type, match=self._type.matcher(arg, error))
 
     def throw(self, arg, error, **kwargs):
         if not arg:
             error("Please specify criteria")
-        return self.get_items(self._type, match=lambda item: not item.match(arg))
+        match = self._type.matcher(arg, error)
+        return self.get_items(self._type, match=lambda item: not match(item))
 
     def _save_lines(self):
         for item in self:
@@ -177,14 +412,308 @@ class Collection(Handler):
             error("Invalid argument")
         return group
 
+    def count_distinct(self, arg, error, **kwargs):
+        if self._type is not Dictionary:
+            error("`count-distinct` can only apply to Dictionary")
+        if not arg or "@" not in arg:
+            error("Invalid argument")
+        args, group_args = [a.split() for a in arg.rsplit("@", 1)]
+        if len(args) == 1:
+            key, precision = args[0], 12
+        elif len(args) == 2:
+            key, precision = args[0], args[1]
+        else:
+            error("Invalid argument")
+        group_args = list(_util.resolve_group_args(*group_args))
+        if not group_args:
+            error("Invalid argument")
+        group_keys = [k for k, s in group_args]
+
+        counters = {}
+        seen = []
+        try:
+            precision = int(precision)
+            for item in self:
+                val = tuple(item[k] for k in group_keys)
+                if val not in counters:
+                    counters[val] = _util.HyperLogLog(precision)
+                    seen.append(val)
+                counters[val].add(item[key])
+        except (KeyError, ValueError):
+            error("Invalid argument")
+
+        result = []
+        for val in _util.sort_group_keys(seen, [s for k, s in group_args]):
+            d = _SequenceDict()
+            for k, v in zip(group_keys, val):
+                d[k] = v
+            d[key] = counters[val].estimate()
+            result.append(d)
+        return List(Dictionary)(result)
+
+    def _join(self, arg, error, console, left):
+        if self._type is not Dictionary:
+            error("`join` can only apply to Dictionary")
+        if not arg or "@" not in arg:
+            error("Invalid argument")
+        name, keys = arg.rsplit("@", 1)
+        name, keys = name.strip(), keys.split()
+        if not name or not keys:
+            error("Invalid argument")
+        if name not in console.stored_values:
+            error("Value '{}' not found".format(name))
+        build = console.stored_values[name]
+        if isinstance(build, Cache) and build._type is Dictionary:
+            build = build.load(name, error).do()
+        if not isinstance(build, List) or build._type is not Dictionary:
+            error("`join` can only use a stored List of Dictionary")
+        try:
+            index, columns = build.index(*keys)
+        except KeyError:
+            error("Invalid argument")
+        columns = [k for k in columns if k not in keys]
+
+        def __iter():
+            for item in self:
+                try:
+                    matches = index.get(tuple(item[k] for k in keys))
+                except KeyError:
+                    error("Invalid argument")
+                if matches is None:
+                    if not left:
+                        continue
+                    matches = [None]
+                for match in matches:
+                    d = _SequenceDict()
+                    for k in item:
+                        d[k] = item[k]
+                    for k in columns:
+                        if k not in d:
+                            d[k] = match[k] if match is not None and k in match else None
+                    yield d
+
+        return __iter
+
+    def __random(self, args, error):
+        try:
+            return _random.Random(int(args[0]) if args else None)
+        except ValueError:
+            error("Invalid argument")
+
+    def sample(self, arg, error, **kwargs):
+        args = arg.split() if arg else []
+        if len(args) not in [1, 2]:
+            error("Invalid argument")
+        try:
+            n = int(args[0])
+        except ValueError:
+            error("Invalid argument")
+        if n <= 0:
+            error("Invalid argument")
+        rng = self.__random(args[1:], error)
+
+        # Algorithm L: the number of items to skip before the next replacement
+        # is drawn directly, instead of drawing a random number for every item
+        def __weight():
+            return _math.exp(_math.log(1.0 - rng.random()) / n)
+
+        def __skip(w):
+            if w >= 1.0:
+                return 0
+            return int(_math.log(1.0 - rng.random()) / _math.log(1.0 - w))
+
+        reservoir = []
+        w = __weight()
+        replace_at = n + __skip(w)
+        for i, item in enumerate(self):
+            if i < n:
+                reservoir.append((i, item))
+            elif i == replace_at:
+                reservoir[rng.randrange(n)] = (i, item)
+                w *= __weight()
+                replace_at += __skip(w) + 1
+        reservoir.sort(key=lambda x: x[0])
+        return List(self._type)([item for i, item in reservoir])
+
+    def sample_rate(self, arg, error, **kwargs):
+        args = arg.split() if arg else []
+        if len(args) not in [1, 2]:
+            error("Invalid argument")
+        try:
+            p = float(args[0])
+        except ValueError:
+            error("Invalid argument")
+        if not 0 <= p <= 1:
+            error("Invalid argument")
+        rng = self.__random(args[1:], error)
+
+        # The gap between two kept items follows a geometric distribution
+        def __skip():
+            if p >= 1:
+                return 0
+            if p <= 0:
+                return -1
+            return int(_math.log(1.0 - rng.random()) / _math.log(1.0 - p))
+
+        def __iter():
+            skip = __skip()
+            for item in self:
+                if skip:
+                    skip -= 1
+                    continue
+                yield item
+                skip = __skip()
+
+        return __iter
+
+    def _dedup(self, arg, error, seen):
+        """
+
+        :param seen: Adds a digest, and returns True if it was added before
+        """
+        keys = arg.split() if arg else []
+        if keys and self._type is Line:
+            error("Invalid argument")
+        if self._type is SplitLine:
+            try:
+                keys = [int(k) for k in keys]
+            except ValueError:
+                error("Invalid argument")
+
+        def __iter():
+            for item in self:
+                if keys:
+                    try:
+                        text = "\0".join(str(item[k]) for k in keys)
+                    except (KeyError, IndexError):
+                        error("Invalid argument")
+                else:
+                    text = str(item)
+                if not seen(_util.digest(text)):
+                    yield item
+
+        return __iter
+
+    def dedup(self, arg, error, **kwargs):
+        digests = set()
+
+        def __seen(digest):
+            if digest in digests:
+                return True
+            digests.add(digest)
+            return False
+
+        return self._dedup(arg, error, __seen)
+
+    def dedup_bloom(self, arg, error, **kwargs):
+        args = arg.split() if arg else []
+        if len(args) < 2:
+            error("Invalid argument")
+        try:
+            bloom = _util.BloomFilter(int(args[0]), float(args[1]))
+        except ValueError:
+            error("Invalid argument")
+        return self._dedup(" ".join(args[2:]), error, bloom.add)
+
+    def join(self, **kwargs):
+        return self._join(left=False, **kwargs)
+
+    def left_join(self, **kwargs):
+        return self._join(left=True, **kwargs)
+
+    def infer_types(self, arg, error, console, **kwargs):
+        if self._type is not Dictionary:
+            error("`infer-types` can only apply to Dictionary")
+        try:
+            sample = int(arg) if arg else Collection.INFER_SAMPLE
+        except ValueError:
+            error("Invalid argument")
+        if sample <= 0:
+            error("Invalid argument")
+
+        def __convert(items, converters, unconverted):
+            """
+            Convert the values of `items`. A key turns from `int` into `float` at its first
+            value that needs it, and values that cannot be converted are left unchanged.
+            """
+            result = []
+            for item in items:
+                d = _SequenceDict()
+                for k in item:
+                    v = item[k]
+                    converter = converters.get(k)
+                    if converter is not None and isinstance(v, str):
+                        try:
+                            v = converter(v)
+                        except ValueError:
+                            try:
+                                if converter is not int:
+                                    raise ValueError
+                                v = float(v)
+                                converters[k] = float
+                            except ValueError:
+                                unconverted[k] = unconverted.get(k, 0) + 1
+                    d[k] = v
+                result.append(d)
+            return result
+
+        def __iter():
+            items = iter(self)
+            head = []
+            for item in items:
+                head.append(item._item)
+                if len(head) >= sample:
+                    break
+            values = {}
+            for item in head:
+                for k in item:
+                    values.setdefault(k, []).append(item[k])
+            converters = {}
+            for k in values:
+                converter = _util.infer_type(values[k])
+                if converter is not None:
+                    converters[k] = converter
+
+            def __name(k):
+                if k in converters:
+                    return converters[k].__name__
+                return type(next((v for v in values[k] if v is not None), "")).__name__
+
+            console.message("Types: " + " ".join("{}={}".format(k, __name(k)) for k in values))
+
+            inferred = dict(converters)
+            unconverted = {}
+            for i in __convert(head, converters, unconverted):
+                yield i
+            batch = []
+            for item in items:
+                batch.append(item._item)
+                if len(batch) >= Collection.BATCH_SIZE:
+                    for i in __convert(batch, converters, unconverted):
+                        yield i
+                    batch = []
+            for i in __convert(batch, converters, unconverted):
+                yield i
+
+            widened = [k for k in converters if converters[k] is not inferred[k]]
+            if widened:
+                console.message("Changed to float: " + " ".join(widened))
+            if unconverted:
+                console.message("Left unconverted: " + " ".join(
+                    "{}={}".format(k, unconverted[k]) for k in unconverted))
+
+        return __iter
+
 
 class List(Collection):
     def __init__(self, type):
         Collection.__init__(self, type)
         self.__items = []
+        self.__indexes = {}
 
     def __call__(self, items):
         self.__items = list(self._type.items(items))
+        self.__indexes = {}
         return self
 
     def __repr__(self):
@@ -199,12 +728,48 @@ class List(Collection):
     def _get_items(self, type, converter, match):
         return List(type)([converter(item) for item in self if match(item)])
 
+    def _get_batches(self, type, func):
+        items = []
+        for i in range(0, len(self), Collection.BATCH_SIZE):
+            items.extend(func([item._item for item in self.__items[i:i + Collection.BATCH_SIZE]]))
+        return List(type)(items)
+
     def limit(self, **kwargs):
         return List(self._type)([item for item in Collection.limit(self, **kwargs)()])
 
-    def print(self, console, **kwargs):
-        for line in self._save_lines():
-            console.output(line)
+    def nbytes(self, sample=100):
+        return self.memory(sample)[0]
+
+    def memory(self, sample=None):
+        """
+        Estimate the memory used by the entries, from the first `sample` of them (default: all).
+
+        :return: The number of bytes, and the share of strings in the entries that are
+            pooled in `STRINGS` (None if there are no strings)
+        """
+        if not self.__items:
+            return _sys.getsizeof(self.__items), None
+        items = self.__items if sample is None else self.__items[:sample]
+        seen = set()
+        strings = []
+        size = sum(_sys.getsizeof(item) + _util.sizeof(item._item, seen, strings) for item in items)
+        pooled = sum(1 for s in strings if STRINGS.pooled(s)) / len(strings) if strings else None
+        return _sys.getsizeof(self.__items) + size * len(self.__items) // len(items), pooled
+
+    def print(self, arg, error, console, **kwargs):
+        if arg == "--page":
+            console.page(self._save_lines())
+            return self
+        lines = self._save_lines()
+        if arg:
+            try:
+                n = int(arg)
+            except ValueError:
+                error("Invalid argument")
+            if n < 0:
+                error("Invalid argument")
+            lines = (line for i, line in zip(range(n), lines))
+        console.output_lines(lines)
         return self
 
     def save(self, **kwargs):
@@ -215,6 +780,44 @@ class List(Collection):
         console.stored_values[arg] = self
         return self
 
+    def index(self, *keys):
+        """
+        Build a hash index of a List of Dictionary, or reuse the one built before.
+
+        :return: A dict from tuples of values of `keys` to lists of items,
+            and all keys of the items in the order they were first seen
+        """
+        if keys not in self.__indexes:
+            index = {}
+            columns = []
+            seen = set()
+            for item in self:
+                index.setdefault(tuple(item[k] for k in keys), []).append(item)
+                for k in item:
+                    if k not in seen:
+                        seen.add(k)
+                        columns.append(k)
+            self.__indexes[keys] = (index, columns)
+        return self.__indexes[keys]
+
+    def sample_rate(self, **kwargs):
+        return List(self._type)(Collection.sample_rate(self, **kwargs)())
+
+    def infer_types(self, **kwargs):
+        return List(self._type)(Collection.infer_types(self, **kwargs)())
+
+    def dedup(self, **kwargs):
+        return List(self._type)(Collection.dedup(self, **kwargs)())
+
+    def dedup_bloom(self, **kwargs):
+        return List(self._type)(Collection.dedup_bloom(self, **kwargs)())
+
+    def join(self, **kwargs):
+        return List(Dictionary)(Collection.join(self, **kwargs)())
+
+    def left_join(self, **kwargs):
+        return List(Dictionary)(Collection.left_join(self, **kwargs)())
+
 
 class Iterator(Collection):
     def __init__(self, type, exit):
@@ -239,6 +842,21 @@ class Iterator(Collection):
 
         return Iterator(type, self.exit)(__iter)
 
+    def _get_batches(self, type, func):
+        def __iter():
+            items = []
+            for item in self:
+                items.append(item._item)
+                if len(items) >= Collection.BATCH_SIZE:
+                    for i in func(items):
+                        yield i
+                    items = []
+            if items:
+                for i in func(items):
+                    yield i
+
+        return Iterator(type, self.exit)(__iter)
+
     def limit(self, **kwargs):
         return Iterator(self._type, self.exit)(Collection.limit(self, **kwargs))
 
@@ -254,6 +872,106 @@ class Iterator(Collection):
         Collection.save(self, **kwargs)
         self.exit()
 
+    def count_distinct(self, **kwargs):
+        result = Collection.count_distinct(self, **kwargs)
+        self.exit()
+        return result
+
+    def sample(self, **kwargs):
+        result = Collection.sample(self, **kwargs)
+        self.exit()
+        return result
+
+    def sample_rate(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.sample_rate(self, **kwargs))
+
+    def infer_types(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.infer_types(self, **kwargs))
+
+    def dedup(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.dedup(self, **kwargs))
+
+    def dedup_bloom(self, **kwargs):
+        return Iterator(self._type, self.exit)(Collection.dedup_bloom(self, **kwargs))
+
+    def join(self, **kwargs):
+        return Iterator(Dictionary, self.exit)(Collection.join(self, **kwargs))
+
+    def left_join(self, **kwargs):
+        return Iterator(Dictionary, self.exit)(Collection.left_join(self, **kwargs))
+
+    def store(self, arg, console, **kwargs):
+        cache = Cache(self._type)
+        console.stored_values[arg] = cache
+
+        def __iter():
+            for item in self:
+                cache.append(item._item)
+                yield item
+            # Reading stops early at Ctrl-C, so the entries may be partial
+            cache.complete = not console.interrupt.requested
+
+        return Iterator(self._type, self.exit)(__iter)
+
+
+class Cache(object):
+    """
+    Entries recorded from an `Iterator` by `store`, to be replayed by `load`.
+
+    Lines are kept as strings, split lines as tuples, and dictionaries as tuples of
+    values, grouped in runs that share the same keys.
+    """
+
+    def __init__(self, type):
+        self._type = type
+        self.complete = False
+        self.__runs = []
+        self.__keys = None
+        self.__rows = None
+        self.__len = 0
+
+    def __repr__(self):
+        return "Cache({}, {} entries{})".format(
+            self._type.__name__, self.__len, "" if self.complete else ", incomplete")
+
+    def __len__(self):
+        return self.__len
+
+    def append(self, item):
+        if self._type is Dictionary:
+            keys = tuple(item)
+            if keys != self.__keys:
+                self.__keys = keys
+                self.__rows = []
+                self.__runs.append((keys, self.__rows))
+            self.__rows.append(tuple(item[k] for k in keys))
+        else:
+            if self.__rows is None:
+                self.__rows = []
+                self.__runs.append((None, self.__rows))
+            self.__rows.append(tuple(item) if self._type is SplitLine else item)
+        self.__len += 1
+
+    def __iter(self):
+        for keys, rows in self.__runs:
+            if keys is not None:
+                for values in rows:
+                    d = _SequenceDict()
+                    for k, v in zip(keys, values):
+                        d[k] = v
+                    yield d
+            elif self._type is SplitLine:
+                for values in rows:
+                    yield list(values)
+            else:
+                for item in rows:
+                    yield item
+
+    def load(self, name, error):
+        if not self.complete:
+            error("Value '{}' was not read to the end".format(name))
+        return Iterator(self._type, lambda: None)(self.__iter)
+
 
 class Iterable(Handler):
     PROJECTED_TYPE = {}
@@ -265,10 +983,34 @@ class Iterable(Handler):
         return self._item
 
     @classmethod
-    def project(cls, name, type):
+    def project(cls, name, type, parse=None, batch=False):
+        """
+        Register a projection.
+
+        :param name: The command
+        :param type: The type after projection
+        :param parse: Turns `arg` and `error` into the parsed argument (default: `arg` itself).
+            Only used for batch projections.
+        :param batch: If True, the decorated function takes a list of items (the contents
+            of Iterables, not the Iterables themselves), the parsed argument and `error`,
+            and returns a list of projected items. The argument is parsed once per command.
+        """
+        if parse is None:
+            parse = lambda arg, error: arg
+
         def __decor(func):
+            if "PROJECTED_TYPE" not in cls.__dict__:
+                cls.PROJECTED_TYPE = dict(cls.PROJECTED_TYPE)
             cls.PROJECTED_TYPE[name] = type
-            setattr(cls, name.replace("-", "_"), func)
+            if batch:
+                def __project(self, arg, error, **kwargs):
+                    return func([self._item], parse(arg, error), error=error, **kwargs)[0]
+
+                __project.parse = parse
+                __project.batch = func
+                setattr(cls, name.replace("-", "_"), __project)
+            else:
+                setattr(cls, name.replace("-", "_"), func)
             return func
 
         return __decor
@@ -295,6 +1037,13 @@ class Iterable(Handler):
     def match(self, arg):
         return True
 
+    @classmethod
+    def matcher(cls, arg, error):
+        """
+        :return: A function that tells whether an item matches the criteria `arg`
+        """
+        return lambda item: item.match(arg)
+
 
 class Line(Iterable):
     def __init__(self, item):
@@ -304,6 +1053,30 @@ class Line(Iterable):
         return _re.search(arg, self._item) is not None
 
 
+class BytesLine(Iterable):
+    """
+    A line that has not been decoded yet.
+    """
+    ENCODING = "utf-8"
+
+    def __init__(self, item):
+        self._item = item.strip()
+
+    def __str__(self):
+        return self._item.decode(BytesLine.ENCODING, "replace")
+
+    def match(self, arg):
+        return _re.search(arg.encode(BytesLine.ENCODING), self._item) is not None
+
+    @classmethod
+    def matcher(cls, arg, error):
+        try:
+            search = _re.compile(arg.encode(BytesLine.ENCODING)).search
+        except _re.error:
+            error("Invalid regex")
+        return lambda item: search(item._item) is not None
+
+
 class SplitLine(Iterable):
     def __str__(self):
         return _format_list(
@@ -352,167 +1125,405 @@ class Dictionary(Iterable):
         return eval(arg)
 
 
-@Line.project("split", SplitLine)
-def __line_split(self, arg, **kwargs):
-    return self._item.split(arg)
-
+def __parse_indexes(arg, error):
+    try:
+        return [int(i) for i in arg.split()]
+    except (AttributeError, ValueError):
+        error("Invalid argument")
 
-@SplitLine.project("split", SplitLine)
-def __splitline_split(self, arg, **kwargs):
-    def __iter():
-        for item in self:
-            for i in item.split(arg):
-                yield i
 
-    return list(__iter())
+def __parse_keys(arg, error):
+    if not arg:
+        error("Invalid argument")
+    return arg.split()
 
 
-@SplitLine.project("take", SplitLine)
-def __splitline_take(self, arg, error, **kwargs):
+def __parse_index_text(arg, error):
     try:
-        return [self[int(i)] for i in arg.split()]
-    except IndexError or ValueError:
+        index, content = arg.split(None, 1)
+        return int(index), content
+    except (AttributeError, ValueError):
         error("Invalid argument")
 
 
-@SplitLine.project("int", SplitLine)
-def __splitline_int(self, arg, error, **kwargs):
-    try:
-        indexes = [int(i) for i in arg.split()]
-        return [int(self[i]) if i in indexes else self[i]
-                for i in range(len(self))]
-    except IndexError or ValueError:
+@Line.project("split", SplitLine, batch=True)
+def __line_split(items, arg, **kwargs):
+    return [item.split(arg) for item in items]
+
+
+DECODE_ERRORS = ["replace", "strict", "ignore", "backslashreplace", "skip"]
+
+
+def __parse_decode(arg, error):
+    args = arg.split() if arg else []
+    if len(args) > 2:
         error("Invalid argument")
+    errors = args[0] if args else DECODE_ERRORS[0]
+    encoding = args[1] if len(args) > 1 else BytesLine.ENCODING
+    if errors not in DECODE_ERRORS:
+        error("Please specify an error policy: {}".format(", ".join(DECODE_ERRORS)))
+    try:
+        _codecs.lookup(encoding)
+    except LookupError:
+        error("Unknown encoding '{}'".format(encoding))
+    return errors, encoding
+
+
+@BytesLine.project("decode", Line, parse=__parse_decode, batch=True)
+def __bytesline_decode(items, args, error, **kwargs):
+    errors, encoding = args
+    if errors == "skip":
+        result = []
+        for item in items:
+            try:
+                result.append(item.decode(encoding))
+            except UnicodeDecodeError:
+                pass
+        return result
+    try:
+        return [item.decode(encoding, errors) for item in items]
+    except UnicodeDecodeError as e:
+        error("Cannot decode line: {}".format(e))
+
+
+PARSE_CASTS = {"int": int, "number": float}
+
+
+def __parse_regex(arg, error):
+    if not arg:
+        error("Please specify a regex")
+    try:
+        pattern = _re.compile(arg)
+    except _re.error:
+        error("Invalid regex")
+    if not pattern.groupindex:
+        error("The regex has no named groups")
+    fields = []
+    for name, index in sorted(pattern.groupindex.items(), key=lambda x: x[1]):
+        key, sep, cast = name.rpartition("__")
+        if sep and key and cast in PARSE_CASTS:
+            fields.append((index - 1, STRINGS.key(key), PARSE_CASTS[cast]))
+        else:
+            fields.append((index - 1, STRINGS.key(name), None))
+    return pattern, fields
 
 
-@SplitLine.project("number", SplitLine)
-def __splitline_float(self, arg, error, **kwargs):
+@Line.project("parse", Dictionary, parse=__parse_regex, batch=True)
+def __line_parse(items, arg, error, **kwargs):
+    pattern, fields = arg
+    search = pattern.search
+    result = []
     try:
-        indexes = [int(i) for i in arg.split()]
-        return [float(self[i]) if i in indexes else self[i]
-                for i in range(len(self))]
-    except IndexError or ValueError:
+        for item in items:
+            m = search(item)
+            if m is None:
+                continue
+            groups = m.groups()
+            d = _SequenceDict()
+            for index, key, cast in fields:
+                value = groups[index]
+                d[key] = STRINGS.value(key, value) if cast is None or value is None else cast(value)
+            result.append(d)
+    except ValueError:
         error("Invalid argument")
+    return result
 
 
-@SplitLine.project("make-dict", Dictionary)
-def __splitline_kv(self, arg, **kwargs):
-    d = _SequenceDict()
-    for i in self:
-        try:
-            k, v = i.split(arg, 1)
-        except ValueError:
-            k, v = i, None
-        d[k] = v
-    return d
+@SplitLine.project("split", SplitLine, batch=True)
+def __splitline_split(items, arg, **kwargs):
+    return [[i for part in item for i in part.split(arg)] for item in items]
 
 
-@SplitLine.project("add-before", SplitLine)
-def __splitline_add_before(self, arg, error, **kwargs):
+@SplitLine.project("take", SplitLine, parse=__parse_indexes, batch=True)
+def __splitline_take(items, indexes, error, **kwargs):
     try:
-        index, content = arg.split(None, 1)
-        index = int(index)
-        length = len(self)
-        return [content + self[i] if i == index % length  else self[i]
-                for i in range(length)]
-    except IndexError or ValueError or TypeError:
+        return [[item[i] for i in indexes] for item in items]
+    except IndexError:
         error("Invalid argument")
 
 
-@SplitLine.project("add-after", SplitLine)
-def __splitline_add_after(self, arg, error, **kwargs):
+def __splitline_convert(items, indexes, converter, error):
+    result = []
     try:
-        index, content = arg.split(None, 1)
-        index = int(index)
-        length = len(self)
-        return [self[i] + content if i == index % length else self[i]
-                for i in range(length)]
-    except IndexError or ValueError or TypeError:
+        for item in items:
+            item = list(item)
+            for i in indexes:
+                if 0 <= i < len(item):
+                    item[i] = converter(item[i])
+            result.append(item)
+    except ValueError:
         error("Invalid argument")
+    return result
+
+
+@SplitLine.project("int", SplitLine, parse=__parse_indexes, batch=True)
+def __splitline_int(items, indexes, error, **kwargs):
+    return __splitline_convert(items, indexes, int, error)
+
+
+@SplitLine.project("number", SplitLine, parse=__parse_indexes, batch=True)
+def __splitline_float(items, indexes, error, **kwargs):
+    return __splitline_convert(items, indexes, float, error)
+
+
+@SplitLine.project("make-dict", Dictionary, batch=True)
+def __splitline_kv(items, arg, **kwargs):
+    result = []
+    for item in items:
+        d = _SequenceDict()
+        for i in item:
+            kv = i.split(arg, 1)
+            if len(kv) == 2:
+                key = STRINGS.key(kv[0])
+                d[key] = STRINGS.value(key, kv[1])
+            else:
+                d[STRINGS.key(i)] = None
+        result.append(d)
+    return result
 
 
-@SplitLine.project("replace", SplitLine)
-def __splitline_add_after(self, arg, error, **kwargs):
+def __splitline_edit(items, index, editor, error):
+    result = []
     try:
-        index, replace, replace_with = arg.split(None, 2)
-        index = int(index)
-        length = len(self)
-        return [self[i].replace(replace, replace_with) if i == index % length else self[i]
-                for i in range(length)]
-    except IndexError or ValueError or TypeError:
+        for item in items:
+            item = list(item)
+            i = index % len(item)
+            item[i] = editor(item[i])
+            result.append(item)
+    except (ZeroDivisionError, TypeError, AttributeError):
         error("Invalid argument")
+    return result
+
 
+@SplitLine.project("add-before", SplitLine, parse=__parse_index_text, batch=True)
+def __splitline_add_before(items, args, error, **kwargs):
+    index, content = args
+    return __splitline_edit(items, index, lambda part: content + part, error)
 
-@Dictionary.project("take", Dictionary)
-def __dictionary_take(self, arg, error, **kwargs):
+
+@SplitLine.project("add-after", SplitLine, parse=__parse_index_text, batch=True)
+def __splitline_add_after(items, args, error, **kwargs):
+    index, content = args
+    return __splitline_edit(items, index, lambda part: part + content, error)
+
+
+def __parse_replace(arg, error):
     try:
-        d = _SequenceDict()
-        for k in arg.split():
-            d[k] = self[k]
-        return d
-    except KeyError:
+        index, replace, replace_with = arg.split(None, 2)
+        return int(index), replace, replace_with
+    except (AttributeError, ValueError):
         error("Invalid argument")
 
 
-@Dictionary.project("int", Dictionary)
-def __dictionary_int(self, arg, error, **kwargs):
+@SplitLine.project("replace", SplitLine, parse=__parse_replace, batch=True)
+def __splitline_replace(items, args, error, **kwargs):
+    index, replace, replace_with = args
+    return __splitline_edit(items, index, lambda part: part.replace(replace, replace_with), error)
+
+
+@Dictionary.project("take", Dictionary, parse=__parse_keys, batch=True)
+def __dictionary_take(items, keys, error, **kwargs):
+    result = []
     try:
-        d = _SequenceDict()
-        int_keys = arg.split()
-        for k in self:
-            d[k] = self[k]
-            if k in int_keys:
-                d[k] = int(d[k])
-        return d
-    except KeyError or ValueError:
+        for item in items:
+            d = _SequenceDict()
+            for k in keys:
+                d[k] = item[k]
+            result.append(d)
+    except KeyError:
         error("Invalid argument")
+    return result
 
 
-@Dictionary.project("number", Dictionary)
-def __dictionary_float(self, arg, error, **kwargs):
+def __dictionary_convert(items, keys, converter, error):
+    keys = set(keys)
+    result = []
     try:
-        d = _SequenceDict()
-        int_keys = arg.split()
-        for k in self:
-            d[k] = self[k]
-            if k in int_keys:
-                d[k] = float(d[k])
-        return d
-    except KeyError or ValueError:
+        for item in items:
+            d = _SequenceDict()
+            for k in item:
+                d[k] = converter(item[k]) if k in keys else item[k]
+            result.append(d)
+    except (TypeError, ValueError):
         error("Invalid argument")
+    return result
+
+
+@Dictionary.project("int", Dictionary, parse=__parse_keys, batch=True)
+def __dictionary_int(items, keys, error, **kwargs):
+    return __dictionary_convert(items, keys, int, error)
 
 
-@Dictionary.project("rename", Dictionary)
-def __dictionary_rename(self, arg, error, **kwargs):
+@Dictionary.project("number", Dictionary, parse=__parse_keys, batch=True)
+def __dictionary_float(items, keys, error, **kwargs):
+    return __dictionary_convert(items, keys, float, error)
+
+
+def __parse_rename(arg, error):
     if not arg:
         error("Invalid argument")
     args = arg.split()
     if len(args) != 2:
         error("Invalid argument")
+    return args
+
+
+@Dictionary.project("rename", Dictionary, parse=__parse_rename, batch=True)
+def __dictionary_rename(items, args, error, **kwargs):
     old_key, new_key = args
-    if old_key not in self:
+    result = []
+    for item in items:
+        if old_key not in item:
+            error("Invalid argument")
+        elif new_key in item:
+            error("Invalid argument")
+        d = _SequenceDict()
+        for key in item:
+            if key == old_key:
+                d[new_key] = item[old_key]
+            else:
+                d[key] = item[key]
+        result.append(d)
+    return result
+
+
+def __parse_bucket(arg, error):
+    try:
+        key, args = arg.split(None, 1)
+        fmt, width = args.rsplit(None, 1)
+        return key, _util.TimeBuckets(fmt, _util.parse_duration(width))
+    except (AttributeError, ValueError):
         error("Invalid argument")
-    elif new_key in self:
+
+
+@Dictionary.project("bucket", Dictionary, parse=__parse_bucket, batch=True)
+def __dictionary_bucket(items, args, error, **kwargs):
+    key, buckets = args
+    result = []
+    try:
+        for item in items:
+            d = _SequenceDict()
+            for k in item:
+                d[k] = item[k]
+            d[key] = buckets(item[key])
+            result.append(d)
+    except (KeyError, ValueError, TypeError):
         error("Invalid argument")
-    d = _SequenceDict()
-    for key in self:
-        if key == old_key:
-            d[new_key] = self[old_key]
+    return result
+
+
+READ_FORMATS = {}
+
+
+def read_format(name):
+    """
+    Register a parser for `read-format`.
+
+    The decorated function takes a list of lines, and returns a list of dicts.
+    Lines that cannot be parsed are dropped.
+    """
+
+    def __decor(func):
+        READ_FORMATS[name] = func
+        return func
+
+    return __decor
+
+
+@read_format("jsonl")
+def __read_jsonl(lines):
+    # Each line is parsed by itself, so that an invalid line cannot merge with its neighbours
+    items = []
+    for line in lines:
+        try:
+            items.append(_json.loads(line))
+        except ValueError:
+            pass
+    result = []
+    for item in items:
+        if isinstance(item, dict):
+            d = _SequenceDict()
+            for k in item:
+                key = STRINGS.key(k)
+                d[key] = STRINGS.value(key, item[k])
+            result.append(d)
+    return result
+
+
+__LOGFMT_PAIR = _re.compile(r'([^\s=]+)(?:(=)(?:"((?:[^"\\]|\\.)*)"|(\S*)))?')
+__ESCAPED = _re.compile(r'\\(.)')
+
+
+@read_format("logfmt")
+def __read_logfmt(lines):
+    result = []
+    for line in lines:
+        d = _SequenceDict()
+        for key, eq, quoted, value in __LOGFMT_PAIR.findall(line):
+            key = STRINGS.key(key)
+            if not eq:
+                d[key] = True
+            elif quoted:
+                d[key] = STRINGS.value(key, __ESCAPED.sub(r"\1", quoted) if "\\" in quoted else quoted)
+            else:
+                d[key] = STRINGS.value(key, value)
+        if len(d):
+            result.append(d)
+    return result
+
+
+__COMBINED = _re.compile(
+    r'(\S+) (\S+) (\S+) \[([^\]]*)\] "((?:[^"\\]|\\.)*)" (\d{3}|-) (\d+|-)'
+    r'(?: "((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)")?'
+)
+
+
+@read_format("combined")
+def __read_combined(lines):
+    result = []
+    for line in lines:
+        m = __COMBINED.match(line)
+        if m is None:
+            continue
+        ip, ident, user, time, request, status, size, referer, agent = m.groups()
+        parts = request.split(" ")
+        if len(parts) == 3:
+            method, path, protocol = parts
         else:
-            d[key] = self[key]
-    return d
+            method, path, protocol = None, request, None
+        d = _SequenceDict()
+        d["ip"] = STRINGS.value("ip", ip)
+        d["ident"] = STRINGS.value("ident", ident)
+        d["user"] = STRINGS.value("user", user)
+        d["time"] = time
+        d["method"] = STRINGS.value("method", method)
+        d["path"] = STRINGS.value("path", path)
+        d["protocol"] = STRINGS.value("protocol", protocol)
+        d["status"] = int(status) if status != "-" else None
+        d["bytes"] = int(size) if size != "-" else 0
+        d["referer"] = STRINGS.value("referer", referer)
+        d["agent"] = STRINGS.value("agent", agent)
+        result.append(d)
+    return result
 
 
 class Group(Handler):
     def __init__(self, *keys):
-        self.__keys = list(keys)
-        key = self.__keys.pop(0)
-        if isinstance(key, list) or isinstance(key, tuple):
-            self.__key, self.__sort = key
-        else:
-            self.__key, self.__sort = key, None
+        """
+
+        :param keys: Each one is a key, or a (key, order) pair where order is "+", "-" or None
+        """
+        self.__keys = []
+        self.__orders = []
+        for key in keys:
+            if isinstance(key, list) or isinstance(key, tuple):
+                key, order = key
+            else:
+                order = None
+            self.__keys.append(key)
+            self.__orders.append(order)
 
-        self.__items = _util.SortedDict(self.__sort)
+        self.__items = {}
 
     def __repr__(self):
         def __formatter(item):
@@ -523,65 +1534,58 @@ class Group(Handler):
                 return k + " " + s
 
         return "Group {}".format(_format_list(
-            [(self.__key, self.__sort)] + self.__keys,
+            list(zip(self.__keys, self.__orders)),
             formatter=__formatter
         ))
 
-    def __iter(self, *kvs):
-        kvs = list(kvs)
-        if self.__keys:
-            for val in self.__items:
-                for i in self[val].__iter(*(kvs + [(self.__key, val)])):
-                    yield i
-        else:
-            for val in self.__items:
-                yield (kvs + [(self.__key, val)], self[val])
+    def __iter(self):
+        for vals in _util.sort_group_keys(self.__items, self.__orders):
+            yield vals, self.__items[vals]
 
     def __iter__(self):
-        for kvs, l in self.__iter():
+        for vals, l in self.__iter():
             for item in l:
                 yield item
 
-    def __getitem__(self, item):
-        return self.__items.__getitem__(item)
-
-    def __setitem__(self, key, value):
-        return self.__items.__setitem__(key, value)
-
     def append(self, item):
-        val = item[self.__key]
-        if val not in self.__items:
-            if self.__keys:
-                self[val] = Group(*self.__keys)
-            else:
-                self[val] = []
-        self[val].append(item)
+        vals = tuple(item[key] for key in self.__keys)
+        l = self.__items.get(vals)
+        if l is None:
+            l = self.__items[vals] = []
+        l.append(item)
 
     def un_group(self, **kwargs):
         a = List(Dictionary)(self)
         return a
 
     def __new_group(self, converter=None, l_converter=None):
-        group = Group((self.__key, self.__sort), *self.__keys)
+        group = Group(*zip(self.__keys, self.__orders))
 
         if l_converter is not None:
-            for kvs, l in self.__iter():
-                group.append(l_converter(kvs, l))
+            for vals, l in self.__iter():
+                group.__items[vals] = [l_converter(vals, l)]
         elif converter is not None:
-            for kvs, l in self.__iter():
-                for item in l:
-                    group.append(converter(kvs, item))
+            for vals, l in self.__iter():
+                group.__items[vals] = [converter(vals, item) for item in l]
         else:
             raise ValueError
 
         return group
 
+    def __key_dict(self, vals):
+        d = _SequenceDict()
+        for k, v in zip(self.__keys, vals):
+            d[k] = v
+        return d
+
     def add_count(self, arg, **kwargs):
         if not arg:
             arg = "count"
 
-        def __add_count(kvs, item):
-            result = item._item.copy()
+        def __add_count(vals, item):
+            result = _SequenceDict()
+            for k in item:
+                result[k] = item[k]
             result[arg] = 1
             return result
 
@@ -591,15 +1595,10 @@ class Group(Handler):
         if not arg:
             arg = "count"
 
-        def __count(kvs, l):
-            keys = []
-            values = []
-            for k, v in kvs:
-                keys.append(k)
-                values.append(v)
-            keys.append(arg)
-            values.append(len(l))
-            return _SequenceDict(*keys, **_to_dict(keys, values))
+        def __count(vals, l):
+            result = self.__key_dict(vals)
+            result[arg] = len(l)
+            return result
 
         return self.__new_group(l_converter=__count)
 
@@ -608,18 +1607,13 @@ class Group(Handler):
             error("No argument given")
         sum_keys = arg.split()
 
-        def __sum(kvs, l):
-            keys = []
-            values = []
-            for k, v in kvs:
-                keys.append(k)
-                values.append(v)
-            keys.extend(sum_keys)
+        def __sum(vals, l):
+            result = self.__key_dict(vals)
             for key in sum_keys:
                 val = 0
                 for item in l:
                     val += item[key]
-                values.append(val)
-            return _SequenceDict(*keys, **_to_dict(keys, values))
+                result[key] = val
+            return result
 
         return self.__new_group(l_converter=__sum)
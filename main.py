@@ -1,64 +1,331 @@
 #!/usr/bin/python3
 
+import io as _io
+import os as _os
+import queue as _queue
+import shutil as _shutil
+import sys as _sys
+import threading as _threading
+
 from mklibpy.terminal import clear_screen as _clear_screen
 from mklibpy.terminal.interact import user_input as _user_input
 
+import cache as _cache
+import client as _client
 import command as _command
+import log as _log
+import parallel as _parallel
+import profiler as _profiler
+import server as _server
 import util as _util
 
 __author__ = 'Michael'
 
 
 class Console(object):
-    def __init__(self):
-        _clear_screen()
+    def __init__(self, clear=True, out=None, stored_values=None, cache=None):
+        """
+
+        :param clear: Clear the screen
+        :param out: The file to write output to (default: stdout)
+        :param stored_values: Share stored values with other consoles
+        :param cache: Share the result cache with other consoles
+        """
+        if clear:
+            _clear_screen()
+        self.out = out
         self.result = None
-        self.stored_values = {}
+        self.lineage = None
+        self.stored_values = {} if stored_values is None else stored_values
+        self.cache = _cache.ResultCache() if cache is None else cache
+        self.profiler = None
+        self.show_progress = out is None and _sys.stderr.isatty()
+        self.interrupt = _util.Interrupt()
+
+    def single_line(self, cmd, arg=None, func=None):
+        lineage = _cache.next_lineage(self.lineage, cmd, arg)
+
+        def __execute():
+            return _command.execute(
+                cmd,
+                func=func,
+                arg=arg,
+                last=self.result,
+                console=self,
+                error=self.error
+            )
+
+        if self.profiler is None:
+            self.result = __execute()
+        else:
+            self.result = self.profiler.command(cmd, arg, self.result, __execute)
 
-    def single_line(self, line):
-        if not line:
+        if self.interrupt.requested:
+            # The result may be partial, so it is not cached
+            self.lineage = None
             return
-        try:
-            cmd, arg = line.split(None, 1)
-        except ValueError:
-            cmd, arg = line, None
-        self.result = _command.execute(
-            cmd,
-            arg=arg,
-            last=self.result,
-            console=self,
-            error=self.error
-        )
+        self.lineage = lineage if self.result is not None else None
+        if lineage is not None and isinstance(self.result, _log.List) and self.cache.capacity:
+            self.cache.put(lineage, self.result, self.result.nbytes())
+
+    def resume(self, lines):
+        """
+        Skip the longest prefix of `lines` whose result is cached, and make it the current result.
+
+        :return: The lines left to execute
+        """
+        if not self.cache.capacity:
+            return lines
+        lineage = self.lineage
+        skip = 0
+        for i, line in enumerate(lines):
+            if line.cmd in _cache.PASS_THROUGH:
+                break
+            lineage = _cache.next_lineage(lineage, line.cmd, line.arg)
+            if lineage is None:
+                break
+            if lineage in self.cache:
+                skip = i + 1
+                found = lineage
+        if not skip:
+            return lines
+        self.result = self.cache.get(found)
+        self.lineage = found
+        return lines[skip:]
 
     def line(self, line):
         MultiLineGroup(line).execute(self)
 
+    def interruptible(self, line):
+        """
+        Execute a line, where Ctrl-C stops reading the file and keeps the partial result.
+        """
+        with self.interrupt:
+            self.line(line)
+        if self.interrupt.rows is not None:
+            self.message("Interrupted after {} rows, the result is partial".format(self.interrupt.rows))
+        elif self.interrupt.requested:
+            self.message("Interrupted, the result may be partial")
+
+    def run(self, name):
+        for line in compile_script(name):
+            if self.interrupt.requested:
+                break
+            line.execute(self)
+
+    def tee(self, arg):
+        """
+        Iterate the current result once, feeding each entry to several branches.
+
+        :param arg: "NAME1: CMD |> CMD ... || NAME2: CMD |> CMD ..."
+        :return: The current result if it is a List, or None if it was an Iter, which is used up
+        """
+        source = self.result
+        if not isinstance(source, _log.Collection):
+            self.error("`tee` can only apply to List or Iter")
+        if not arg:
+            self.error("Invalid argument")
+        branches = []
+        for branch in arg.split("||"):
+            name, sep, commands = branch.partition(":")
+            name = name.strip()
+            if not sep or not name or len(name.split()) != 1:
+                self.error("Invalid argument")
+            branches.append(Branch(self, source._type, name, commands.split("|>")))
+
+        def __send(chunk):
+            for b in branches:
+                b.send(chunk)
+
+        for b in branches:
+            b.start()
+        try:
+            chunk = []
+            for item in source:
+                chunk.append(item)
+                if len(chunk) >= _log.Collection.BATCH_SIZE:
+                    __send(chunk)
+                    chunk = []
+                    if all(b.done.is_set() for b in branches):
+                        break
+            if chunk:
+                __send(chunk)
+            __send(None)
+        finally:
+            if isinstance(source, _log.Iterator):
+                source.exit()
+            for b in branches:
+                b.stop()
+
+        for b in branches:
+            if b.error is not None:
+                self.show_error("{}: {}".format(b.name, b.error))
+            elif b.result is not None:
+                self.stored_values[b.name] = b.result
+        self.message("Stored{}: {}".format(
+            " (partial)" if self.interrupt.requested else "",
+            ", ".join(b.name for b in branches if b.name in self.stored_values and b.error is None)))
+        if isinstance(source, _log.Iterator):
+            return None
+        return source
+
+    def parallel(self, arg):
+        """
+        :param arg: "[WORKERS] CMD ARG"
+        """
+        args = arg.split(None, 1) if arg else []
+        workers = _os.cpu_count() or 1
+        if args and args[0].isdigit():
+            workers = int(args[0])
+            args = args[1].split(None, 1) if len(args) > 1 else []
+        if len(args) != 2 or workers <= 0:
+            self.error("Invalid argument")
+        result = _parallel.aggregate(Console, self.result, self.lineage, workers, args[0], args[1], self.error,
+                                     self.interrupt)
+        if isinstance(self.result, _log.Iterator):
+            self.result.exit()
+        return result
+
+    def set_cache(self, arg):
+        """
+        :param arg: None to show the cache, "clear", or the capacity in MB (0 disables it)
+        """
+        if not arg:
+            self.message(repr(self.cache))
+        elif arg == "clear":
+            self.cache.clear()
+        else:
+            try:
+                capacity = float(arg)
+            except ValueError:
+                self.error("Invalid argument")
+            if capacity < 0:
+                self.error("Invalid argument")
+            self.cache.resize(int(capacity * 1024 * 1024))
+
+    def profile(self, on):
+        if on and self.profiler is None:
+            self.profiler = _profiler.Profiler()
+        elif not on and self.profiler is not None:
+            self.profiler.report(self)
+            self.profiler = None
+
+    def new_progress(self, size):
+        """
+        :return: A progress line of reading `size` bytes, or None if progress is not shown
+        """
+        if not self.show_progress:
+            return None
+        return _util.Progress(size)
+
+    def report(self):
+        if self.profiler is not None:
+            self.profiler.report(self)
+
     def exit(self):
         raise _util.ExitCommand
 
     def reset(self):
+        _log.STRINGS.clear()
         raise _util.ResetCommand
 
     def error(self, message):
         raise _util.Error(message)
 
     def output(self, message):
-        print(message)
+        print(message, file=self.out)
+
+    def output_lines(self, lines):
+        """
+        Print lines in blocks, with one write for each block.
+        """
+        out = self.out if self.out is not None else _sys.stdout
+        block = []
+        for line in lines:
+            block.append(line)
+            if len(block) >= OUTPUT_BLOCK:
+                block.append("")
+                out.write("\n".join(block))
+                block = []
+        if block:
+            block.append("")
+            out.write("\n".join(block))
+        out.flush()
+
+    def page(self, lines):
+        """
+        Print lines one screen at a time, asking before each next screen.
+
+        Lines are only formatted when shown. Everything is printed at once if not on a terminal.
+        """
+        if self.out is not None or not _sys.stdout.isatty():
+            self.output_lines(lines)
+            return
+        size = max(_shutil.get_terminal_size().lines - 1, 1)
+        lines = iter(lines)
+        while True:
+            screen = []
+            for line in lines:
+                screen.append(line)
+                if len(screen) >= size:
+                    break
+            self.output_lines(screen)
+            if len(screen) < size:
+                return
+            if _user_input("-- More (Enter: next page, q: quit) --").strip().lower() == "q":
+                return
 
     def message(self, message):
-        _util.message(message)
+        _util.message(message, file=self.out)
+
+    def show_error(self, message):
+        _util.error(message, file=self.out)
 
     def print(self):
         if self.result is not None:
-            _util.result(repr(self.result))
+            _util.result(repr(self.result), file=self.out)
+
+
+OUTPUT_BLOCK = 4096
+
+
+class StreamConsole(Console):
+    """
+    A console in a shell pipeline: results go to `out`, messages go to stderr without colors.
+    """
+
+    def __init__(self, out):
+        Console.__init__(self, clear=False, out=out)
+        self.failed = False
+        self.last_cmd = None
+
+    def single_line(self, cmd, arg=None, func=None):
+        Console.single_line(self, cmd, arg, func)
+        self.last_cmd = cmd
+
+    def message(self, message):
+        print(message, file=_sys.stderr)
+
+    def show_error(self, message):
+        self.failed = True
+        print(message, file=_sys.stderr)
+
+    def print(self):
+        pass
 
 
 class SingleLine(object):
     def __init__(self, line):
-        self.line = line.strip()
+        line = line.strip()
+        try:
+            self.cmd, self.arg = line.split(None, 1)
+        except ValueError:
+            self.cmd, self.arg = line, None
+        self.func = _command.get(self.cmd)
 
     def execute(self, console):
-        console.single_line(self.line)
+        if self.cmd:
+            console.single_line(self.cmd, self.arg, self.func)
 
 
 class MultiLine(object):
@@ -67,12 +334,85 @@ class MultiLine(object):
 
     def execute(self, console):
         try:
-            for l in self.lines:
+            for l in console.resume(self.lines):
+                if console.interrupt.requested:
+                    break
                 l.execute(console)
+        except (_util.ExitCommand, _util.ResetCommand):
+            raise
         except _util.Error as e:
-            _util.error(e.msg)
+            console.show_error(e.msg)
+        except KeyboardInterrupt:
+            if not console.interrupt.requested:
+                raise
+            # Ctrl-C pressed again before reading stopped: drop the unfinished `Iter`, and close its file
+            if isinstance(console.result, _log.Iterator):
+                console.result.exit()
+                console.result = None
+                console.lineage = None
+            console.interrupt.rows = None
         except Exception as e:
-            _util.error("Unhandled exception: {}".format(e))
+            console.show_error("Unhandled exception: {}".format(e))
+
+
+class Branch(object):
+    """
+    A pipeline of `tee`, executed in its own thread on the entries sent to it.
+    """
+    QUEUE_DEPTH = 4
+
+    def __init__(self, console, type, name, lines):
+        self.name = name
+        self.result = None
+        self.error = None
+        self.done = _threading.Event()
+        self.__lines = [SingleLine(l) for l in lines]
+        self.__queue = _queue.Queue(Branch.QUEUE_DEPTH)
+        self.__console = Console(clear=False, out=console.out, stored_values=console.stored_values)
+        self.__console.result = _log.Iterator(type, lambda: None)(self.__receive)
+        self.__console.interrupt = console.interrupt
+        self.__thread = _threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+
+    def __receive(self):
+        while True:
+            chunk = self.__queue.get()
+            if chunk is None:
+                return
+            for item in chunk:
+                yield item
+
+    def __run(self):
+        try:
+            for line in self.__lines:
+                line.execute(self.__console)
+            self.result = self.__console.result
+            if isinstance(self.result, _log.Iterator):
+                self.result = self.result.do()
+        except _util.Error as e:
+            self.error = e.msg
+        except Exception as e:
+            self.error = "Unhandled exception: {}".format(e)
+        finally:
+            self.done.set()
+
+    def start(self):
+        self.__thread.start()
+
+    def send(self, chunk):
+        """
+        Send a list of entries, or None when there are no more. Ignored if the branch has finished.
+        """
+        while not self.done.is_set():
+            try:
+                self.__queue.put(chunk, timeout=0.1)
+                return
+            except _queue.Full:
+                pass
+
+    def stop(self):
+        self.send(None)
+        self.__thread.join()
 
 
 class MultiLineGroup(object):
@@ -83,32 +423,109 @@ class MultiLineGroup(object):
 
     def execute(self, console):
         for l in self.lines:
+            if console.interrupt.requested:
+                break
             l.execute(console)
 
 
+__scripts = {}
+
+
+def compile_script(name):
+    """
+    Parse a script into a list of `MultiLineGroup`.
+
+    Parsed scripts are cached by path, and reused as long as the file is not modified.
+    """
+    path = _os.path.abspath(name)
+    stat = _os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if path in __scripts and __scripts[path][0] == version:
+        return __scripts[path][1]
+    with open(path) as f:
+        script = [MultiLineGroup(line) for line in f]
+    __scripts[path] = (version, script)
+    return script
+
+
 def main():
     console = Console()
     while True:
         try:
             line = _user_input("> ")
-            console.line(line)
+            console.interruptible(line)
         except _util.ResetCommand:
             console = Console()
             continue
         except _util.ExitCommand:
             break
+        console.report()
         console.print()
 
 
-def script(name):
+def script(name, profile=False):
     console = Console()
-    console.line("run " + name)
+    console.profile(profile)
+    try:
+        console.interruptible("run " + name)
+    except (_util.ExitCommand, _util.ResetCommand):
+        pass
+    console.report()
+
+
+STREAM_BUFFER = 1024 * 1024
+
+
+def stream(line):
+    """
+    Execute a line on the lines of stdin, and write the result to stdout.
+
+    :return: Exit status
+    """
+    out = _io.open(_sys.stdout.fileno(), "w", buffering=STREAM_BUFFER, closefd=False)
+    console = StreamConsole(out)
+    console.result = _log.Iterator(_log.Line, lambda: None)(lambda: _sys.stdin)
+    try:
+        try:
+            console.line(line)
+        except (_util.ExitCommand, _util.ResetCommand):
+            pass
+        if console.failed:
+            return 1
+        # A pipeline ending in `print` has written its result already
+        if console.last_cmd != "print" and isinstance(console.result, (_log.Collection, _log.Group)):
+            console.output_lines(str(item) for item in console.result)
+        out.flush()
+    except BrokenPipeError:
+        # The reader went away (e.g. `head`); silence the final flush of stdout
+        _os.dup2(_os.open(_os.devnull, _os.O_WRONLY), _sys.stdout.fileno())
+        return 0
+    return 0
 
 
 if __name__ == "__main__":
-    from sys import argv
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("script", nargs="?",
+                        help="execute a script instead of entering interactive mode")
+    parser.add_argument("--profile", action="store_true",
+                        help="print a cost table for every command when the script ends")
+    parser.add_argument("-e", dest="line", metavar="COMMANDS",
+                        help="execute commands on the lines of stdin, and write the result to stdout")
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="keep running and accept commands over a Unix socket")
+    parser.add_argument("--connect", metavar="SOCKET",
+                        help="send commands to a program started with --serve")
+    args = parser.parse_args()
 
-    if len(argv) <= 1:
+    if args.line is not None:
+        _sys.exit(stream(args.line))
+    elif args.serve is not None:
+        _server.serve(args.serve, Console)
+    elif args.connect is not None:
+        _client.connect(args.connect, args.script)
+    elif args.script is None:
         main()
     else:
-        script(argv[1])
+        script(args.script, profile=args.profile)
@@ -0,0 +1,251 @@
+import io as _io
+import multiprocessing as _multiprocessing
+import signal as _signal
+
+from mklibpy.common.collection import SequenceDict as _SequenceDict
+
+import cache as _cache
+import log as _log
+import util as _util
+
+__author__ = 'Michael'
+
+# Commands that read the file
+READERS = {"read-lines", "read-by-line", "read-bytes", "read-format"}
+
+# Commands that work on each entry by itself, and can run on any part of a file
+ROW_LOCAL = {
+    "do", "split", "parse", "make-dict", "decode", "keep", "throw", "take", "int", "number",
+    "add-before", "add-after", "replace", "rename", "bucket",
+}
+
+RANGES_PER_WORKER = 4
+MIN_RANGE = 1024 * 1024
+
+
+class Aggregate(object):
+    """
+    Aggregates of groups of entries, which can be merged with the aggregates of other entries.
+    """
+
+    def __init__(self, arg, error):
+        if not arg or "@" not in arg:
+            error("Invalid argument")
+        arg, group_args = [a.strip() for a in arg.rsplit("@", 1)]
+        self.group_args = list(_util.resolve_group_args(*group_args.split()))
+        if not self.group_args:
+            error("Invalid argument")
+        self.keys = [k for k, s in self.group_args]
+        self.groups = {}
+        self.parse(arg, error)
+
+    def parse(self, arg, error):
+        pass
+
+    def new(self):
+        pass
+
+    def add(self, value, item):
+        """
+        Add an entry to the aggregate of its group.
+
+        :return: The new aggregate
+        """
+        pass
+
+    def combine(self, value, other):
+        """
+        :return: The aggregate of two parts of a group
+        """
+        pass
+
+    def fill(self, d, value):
+        """
+        Put the aggregate of a group into its result.
+        """
+        pass
+
+    def add_all(self, items):
+        groups = self.groups
+        keys = self.keys
+        for item in items:
+            vals = tuple(item[k] for k in keys)
+            value = groups.get(vals)
+            if value is None:
+                value = self.new()
+            groups[vals] = self.add(value, item)
+
+    def merge(self, other):
+        for vals, value in other.groups.items():
+            if vals in self.groups:
+                self.groups[vals] = self.combine(self.groups[vals], value)
+            else:
+                self.groups[vals] = value
+
+    def rows(self):
+        result = []
+        for vals in _util.sort_group_keys(self.groups, [s for k, s in self.group_args]):
+            d = _SequenceDict()
+            for k, v in zip(self.keys, vals):
+                d[k] = v
+            self.fill(d, self.groups[vals])
+            result.append(d)
+        return result
+
+
+class Count(Aggregate):
+    def parse(self, arg, error):
+        self.name = arg or "count"
+
+    def new(self):
+        return 0
+
+    def add(self, value, item):
+        return value + 1
+
+    def combine(self, value, other):
+        return value + other
+
+    def fill(self, d, value):
+        d[self.name] = value
+
+
+class Sum(Aggregate):
+    def parse(self, arg, error):
+        if not arg:
+            error("No argument given")
+        self.sum_keys = arg.split()
+
+    def new(self):
+        return [0] * len(self.sum_keys)
+
+    def add(self, value, item):
+        for i, k in enumerate(self.sum_keys):
+            value[i] += item[k]
+        return value
+
+    def combine(self, value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def fill(self, d, value):
+        for k, v in zip(self.sum_keys, value):
+            d[k] = v
+
+
+class CountDistinct(Aggregate):
+    def parse(self, arg, error):
+        args = arg.split()
+        if len(args) not in [1, 2]:
+            error("Invalid argument")
+        self.key = args[0]
+        try:
+            self.precision = int(args[1]) if len(args) == 2 else 12
+            _util.HyperLogLog(self.precision)
+        except ValueError:
+            error("Invalid argument")
+
+    def new(self):
+        return _util.HyperLogLog(self.precision)
+
+    def add(self, value, item):
+        value.add(item[self.key])
+        return value
+
+    def combine(self, value, other):
+        value.merge(other)
+        return value
+
+    def fill(self, d, value):
+        d[self.key] = value.estimate()
+
+
+AGGREGATES = {
+    "count": Count,
+    "sum": Sum,
+    "count-distinct": CountDistinct,
+}
+
+
+def split_ranges(name, size, n):
+    """
+    Split a file into at most `n` ranges of whole lines.
+
+    :return: A list of (start, stop) byte offsets
+    """
+    bounds = [0]
+    with open(name, "rb") as f:
+        for i in range(1, n):
+            f.seek(size * i // n - 1)
+            f.readline()
+            bound = min(f.tell(), size)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def __init_worker():
+    # Ctrl-C is handled by the main process, which stops waiting for the workers
+    _signal.signal(_signal.SIGINT, _signal.SIG_IGN)
+
+
+def __work(task):
+    console_type, name, start, stop, lines, aggregate = task
+    console = console_type(clear=False, out=_io.StringIO())
+    console.result = _log.OpenedFile(name, start, stop)
+    try:
+        for cmd, arg in lines:
+            console.single_line(cmd, arg)
+        aggregate.add_all(console.result)
+    except KeyError:
+        raise _util.Error("Invalid argument")
+    finally:
+        if isinstance(console.result, _log.Iterator):
+            console.result.exit()
+    return aggregate
+
+
+def aggregate(console_type, last, lineage, workers, cmd, arg, error, interrupt=None):
+    """
+    Compute an aggregate of a result read from a file, in `workers` processes.
+
+    Each process reads a part of the file, repeats the commands in `lineage` on it,
+    and aggregates its entries. The aggregates are then merged in the order of the parts.
+
+    :param console_type: Creates the consoles of the processes
+    :param last: The result
+    :param lineage: The lineage of the result, see `cache.next_lineage`
+    :param interrupt: If requested, stop after the next part, and return the aggregate of the parts so far
+    """
+    if not isinstance(last, _log.Collection) or last._type is not _log.Dictionary:
+        error("`parallel` can only apply to List or Iter of Dictionary")
+    if cmd not in AGGREGATES:
+        error("Only {} can run in parallel".format(", ".join(sorted(AGGREGATES))))
+    result = AGGREGATES[cmd](arg, error)
+    if lineage is None or len(lineage) < 2:
+        error("`parallel` can only apply to the result of reading a file")
+    identity = lineage[0]
+    lines = []
+    for line in lineage[1:]:
+        args = line.split(None, 1)
+        lines.append((args[0], args[1] if len(args) > 1 else None))
+    if lines[0][0] not in READERS:
+        error("`parallel` can only apply to the result of reading a file")
+    for c, a in lines[1:]:
+        if c not in ROW_LOCAL:
+            error("`{}` cannot run in parallel".format(c))
+    if _cache.file_identity(identity[0]) != identity:
+        error("File '{}' has been modified".format(identity[0]))
+
+    name, size = identity[0], identity[1]
+    n = max(1, min(workers * RANGES_PER_WORKER, size // MIN_RANGE))
+    tasks = [(console_type, name, start, stop, lines, AGGREGATES[cmd](arg, error))
+             for start, stop in split_ranges(name, size, n)]
+    if tasks:
+        with _multiprocessing.Pool(min(workers, len(tasks)), __init_worker) as pool:
+            for partial in pool.imap(__work, tasks):
+                result.merge(partial)
+                if interrupt is not None and interrupt.requested:
+                    break
+    return _log.List(_log.Dictionary)(result.rows())
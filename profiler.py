@@ -0,0 +1,185 @@
+import sys as _sys
+import time as _time
+
+try:
+    import resource as _resource
+except ImportError:
+    _resource = None
+
+import log as _log
+
+__author__ = 'Michael'
+
+
+def _max_rss():
+    """
+    Peak resident set size of the process in KB, or None if unknown.
+    """
+    if _resource is None:
+        return None
+    rss = _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss
+    if _sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def _rows(value):
+    if isinstance(value, _log.List):
+        return len(value)
+    return None
+
+
+class Record(object):
+    def __init__(self, name, upstream=None, source=None):
+        self.name = name
+        self.upstream = upstream
+        self.source = source
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_read = 0
+        self.rss = None
+        self.rows_in = None
+        self.rows_out = None
+        self.lazy = False
+        self.done = True
+
+    def self_wall(self):
+        if self.upstream is not None and self.upstream.lazy:
+            return self.wall - self.upstream.wall
+        return self.wall
+
+    def self_cpu(self):
+        if self.upstream is not None and self.upstream.lazy:
+            return self.cpu - self.upstream.cpu
+        return self.cpu
+
+    def self_bytes_read(self):
+        if self.upstream is not None and self.upstream.lazy:
+            return self.bytes_read - self.upstream.bytes_read
+        return self.bytes_read
+
+
+class Profiler(object):
+    def __init__(self):
+        self.__records = []
+        self.__stages = {}
+
+    def __bytes_read(self, source):
+        if source is None:
+            return 0
+        return source.bytes_read
+
+    def command(self, cmd, arg, last, execute):
+        """
+        Execute a command and record its cost.
+
+        If the command results in an `Iterator`, it is wrapped so that the cost of
+        the lazy stage is recorded as well when it is eventually iterated.
+        """
+        stage = self.__stages.get(id(last))
+        upstream = stage[1] if stage is not None and stage[0] is last else None
+        if isinstance(last, _log.OpenedFile):
+            source = last
+        elif upstream is not None:
+            source = upstream.source
+        else:
+            source = None
+
+        record = Record(cmd if not arg else cmd + " " + arg, upstream, source)
+        self.__records.append(record)
+        if upstream is None:
+            record.rows_in = _rows(last)
+
+        bytes_read = self.__bytes_read(source)
+        rss = _max_rss()
+        wall = _time.perf_counter()
+        cpu = _time.process_time()
+        try:
+            result = execute()
+        finally:
+            record.wall = _time.perf_counter() - wall
+            record.cpu = _time.process_time() - cpu
+            record.bytes_read = self.__bytes_read(source) - bytes_read
+            if rss is not None:
+                record.rss = _max_rss() - rss
+
+        if isinstance(result, _log.Iterator) and result is not last:
+            return self.__stage(record, result)
+        record.rows_out = _rows(result)
+        return result
+
+    def __stage(self, record, iterator):
+        record.lazy = True
+        record.done = False
+        record.rows_out = 0
+        source = record.source
+
+        def __iter():
+            items = iter(iterator)
+            rss = _max_rss()
+            try:
+                while True:
+                    bytes_read = self.__bytes_read(source)
+                    wall = _time.perf_counter()
+                    cpu = _time.process_time()
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        record.wall += _time.perf_counter() - wall
+                        record.cpu += _time.process_time() - cpu
+                        record.bytes_read += self.__bytes_read(source) - bytes_read
+                    record.rows_out += 1
+                    yield item
+            finally:
+                if rss is not None:
+                    record.rss = _max_rss() - rss
+                record.done = True
+
+        def __exit():
+            iterator.exit()
+            record.done = True
+
+        stage = _log.Iterator(iterator._type, __exit)(__iter)
+        self.__stages[id(stage)] = (stage, record)
+        return stage
+
+    def report(self, console):
+        """
+        Print all records that are settled, and forget them.
+
+        Lazy stages that have not been iterated yet are kept for the next report.
+        """
+        records = [r for r in self.__records if r.done]
+        if not records:
+            return
+        self.__records = [r for r in self.__records if not r.done]
+        self.__stages = {k: v for k, v in self.__stages.items() if not v[1].done}
+
+        def __format(value, fmt="{}"):
+            if value is None:
+                return "-"
+            return fmt.format(value)
+
+        table = [["command", "wall(s)", "cpu(s)", "rows in", "rows out", "bytes read", "rss(KB)"]]
+        for r in records:
+            name = r.name if not r.lazy else r.name + " (lazy)"
+            table.append([
+                name,
+                __format(r.self_wall(), "{:.3f}"),
+                __format(r.self_cpu(), "{:.3f}"),
+                __format(r.upstream.rows_out if r.upstream is not None else r.rows_in),
+                __format(r.rows_out),
+                __format(r.self_bytes_read() if r.source is not None else None),
+                __format(r.rss),
+            ])
+        widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+        for row in table:
+            console.output("  ".join(
+                [row[0].ljust(widths[0])] +
+                [row[i].rjust(widths[i]) for i in range(1, len(row))]
+            ))
+        for r in records:
+            if r.upstream is None and r.source is not None and r.source.read_ahead is not None:
+                console.output("{}: {!r}".format(r.name, r.source.read_ahead))
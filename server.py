@@ -0,0 +1,81 @@
+import asyncio as _asyncio
+import io as _io
+import os as _os
+import stat as _stat
+
+import cache as _cache
+import util as _util
+
+__author__ = 'Michael'
+
+END = "\0"
+
+
+def serve(path, console_type):
+    """
+    Accept command lines over a Unix socket at `path`, until interrupted.
+
+    Each client gets its own console, and all consoles share stored values and cached results.
+    Lines are executed one at a time across all clients. The output of each line
+    is sent back, followed by a line of `END`.
+    """
+    stored_values = {}
+    cache = _cache.ResultCache()
+
+    def __new_console(out):
+        return console_type(clear=False, out=out, stored_values=stored_values, cache=cache)
+
+    def __execute(console, line):
+        """
+
+        :return: The console for the next line, or None if the client exits
+        """
+        try:
+            console.line(line)
+        except _util.ResetCommand:
+            return __new_console(console.out)
+        except _util.ExitCommand:
+            return None
+        console.report()
+        console.print()
+        return console
+
+    async def __serve():
+        lock = _asyncio.Lock()
+        loop = _asyncio.get_event_loop()
+
+        async def __session(reader, writer):
+            out = _io.StringIO()
+            console = __new_console(out)
+            try:
+                while console is not None:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    async with lock:
+                        console = await loop.run_in_executor(
+                            None, __execute, console, line.decode())
+                    reply = out.getvalue()
+                    if console is not None:
+                        reply += END + "\n"
+                    out.seek(0)
+                    out.truncate()
+                    writer.write(reply.encode())
+                    await writer.drain()
+            finally:
+                writer.close()
+
+        server = await _asyncio.start_unix_server(__session, path)
+        _util.message("Listening on {}".format(path))
+        async with server:
+            await server.serve_forever()
+
+    if _os.path.exists(path) and _stat.S_ISSOCK(_os.stat(path).st_mode):
+        _os.unlink(path)
+    try:
+        _asyncio.run(__serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if _os.path.exists(path):
+            _os.unlink(path)
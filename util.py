@@ -1,3 +1,11 @@
+import datetime as _datetime
+import hashlib as _hashlib
+import math as _math
+import signal as _signal
+import sys as _sys
+import threading as _threading
+import time as _time
+
 from mklibpy.terminal import colored_text as _colored_text
 
 __author__ = 'Michael'
@@ -16,62 +24,16 @@ class Error(Exception):
         self.msg = msg
 
 
-def result(text):
-    print(_colored_text.get_text(text, "cyan"))
-
-
-def message(text):
-    print(_colored_text.get_text(text, "green"))
+def result(text, file=None):
+    print(_colored_text.get_text(text, "cyan"), file=file)
 
 
-def error(text):
-    print(_colored_text.get_text(text, "red"))
+def message(text, file=None):
+    print(_colored_text.get_text(text, "green"), file=file)
 
 
-class SortedDict(object):
-    def __init__(self, order=None):
-        """
-
-        :param reversed:
-            None (default): not sorted
-            "+": ascending
-            "-": descending
-        """
-        self.__keys = []
-        self.__dict = {}
-        self.__order = order
-
-    def __getitem__(self, key):
-        return self.__dict[key]
-
-    def __contains__(self, item):
-        return item in self.__keys
-
-    def __iter__(self):
-        return self.__keys.__iter__()
-
-    def __len__(self):
-        return len(self.__keys)
-
-    def __setitem__(self, key, value):
-        if key not in self.__keys:
-            if self.__order == "+":
-                for i in range(len(self.__keys)):
-                    if self.__keys[i] > key:
-                        self.__keys.insert(i, key)
-                        break
-                else:
-                    self.__keys.append(key)
-            elif self.__order == "-":
-                for i in range(len(self.__keys)):
-                    if self.__keys[i] < key:
-                        self.__keys.insert(i, key)
-                        break
-                else:
-                    self.__keys.append(key)
-            else:
-                self.__keys.append(key)
-        self.__dict[key] = value
+def error(text, file=None):
+    print(_colored_text.get_text(text, "red"), file=file)
 
 
 def resolve_group_args(*args):
@@ -88,3 +50,361 @@ def resolve_group_args(*args):
             i = arg
     if i is not None:
         yield i, None
+
+
+def sort_group_keys(keys, orders):
+    """
+    Order composite group keys the same way nested groups would.
+
+    :param keys: Tuples of values, in the order they were first seen
+    :param orders: "+", "-" or None for each position of the tuples
+    """
+    keys = list(keys)
+    seen = {}
+    for key in keys:
+        for i in range(1, len(key) + 1):
+            seen.setdefault(key[:i], len(seen))
+    for i in reversed(range(len(orders))):
+        if orders[i] is None:
+            keys.sort(key=lambda k: seen[k[:i + 1]])
+        else:
+            keys.sort(key=lambda k: k[i], reverse=orders[i] == "-")
+    return keys
+
+
+def sizeof(value, seen=None, strings=None):
+    """
+    Approximate number of bytes used by a value, including the values it contains.
+
+    :param seen: A set of ids of objects already counted, so that shared objects are counted once
+    :param strings: A list that every string found is appended to
+    """
+    if strings is not None and isinstance(value, str):
+        strings.append(value)
+    if seen is not None:
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+    size = _sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float)) or value is None:
+        return size
+    if isinstance(value, (list, tuple, set)):
+        return size + sum(sizeof(v, seen, strings) for v in value)
+    if hasattr(value, "__getitem__"):
+        # Mappings, including SequenceDict, which keeps its keys in a list and a dict
+        keys = list(value)
+        return size + _sys.getsizeof(keys) + _sys.getsizeof(dict.fromkeys(keys)) + \
+            sum(sizeof(k, seen, strings) + sizeof(value[k], seen, strings) for k in keys)
+    return size
+
+
+class StringPool(object):
+    """
+    Shares equal strings between entries, so that each of them is kept in memory once.
+
+    The first `MAX_KEYS` distinct keys are pooled. Values are pooled separately for each
+    of those keys, until the key has `threshold` distinct values; after that, only those
+    values are shared.
+    """
+    DEFAULT_THRESHOLD = 1024
+    MAX_KEYS = 4096
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.hits = 0
+        self.lookups = 0
+        self.__keys = {}
+        self.__values = {}
+        self.__ids = set()
+
+    def __repr__(self):
+        return "StringPool({} keys, {} values, threshold {}, value hit rate {})".format(
+            len(self.__keys), sum(len(pool) for pool in self.__values.values()), self.threshold,
+            "{:.1%}".format(self.hits / self.lookups) if self.lookups else "-")
+
+    def key(self, s):
+        pooled = self.__keys.get(s)
+        if pooled is None:
+            if len(self.__keys) >= StringPool.MAX_KEYS:
+                return s
+            pooled = self.__keys[s] = s
+            self.__ids.add(id(s))
+        return pooled
+
+    def value(self, key, s):
+        if type(s) is not str or not self.threshold:
+            return s
+        pool = self.__values.get(key)
+        if pool is None:
+            if len(self.__values) >= StringPool.MAX_KEYS:
+                return s
+            pool = self.__values[key] = {}
+        self.lookups += 1
+        pooled = pool.get(s)
+        if pooled is not None:
+            self.hits += 1
+            return pooled
+        if len(pool) < self.threshold:
+            pool[s] = s
+            self.__ids.add(id(s))
+        return s
+
+    def pooled(self, s):
+        return id(s) in self.__ids
+
+    def clear(self):
+        """
+        Forget all pooled strings, so that they can be freed with the entries that use them.
+        """
+        self.hits = 0
+        self.lookups = 0
+        self.__keys.clear()
+        self.__values.clear()
+        self.__ids.clear()
+
+
+def infer_type(values):
+    """
+    The narrowest of `int` and `float` that all strings in `values` can be converted to.
+
+    :return: None if some string cannot be converted, or if there are no strings
+    """
+    result = None
+    for v in values:
+        if not isinstance(v, str):
+            continue
+        if result in [None, int]:
+            try:
+                int(v)
+                result = int
+                continue
+            except ValueError:
+                pass
+        try:
+            float(v)
+            result = float
+        except ValueError:
+            return None
+    return result
+
+
+def digest(value):
+    """
+    A 16-byte digest of `str(value)`.
+    """
+    return _hashlib.md5(str(value).encode()).digest()
+
+
+def hash64(value):
+    return int.from_bytes(digest(value)[:8], "big")
+
+
+class HyperLogLog(object):
+    def __init__(self, precision=12):
+        """
+
+        :param precision: 4 to 16; uses 2 ** precision bytes
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError
+        self.__p = precision
+        self.__m = 1 << precision
+        self.__registers = bytearray(self.__m)
+
+    def add(self, value):
+        x = hash64(value)
+        bits = 64 - self.__p
+        j = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.__registers[j]:
+            self.__registers[j] = rank
+
+    def merge(self, other):
+        if other.__p != self.__p:
+            raise ValueError
+        self.__registers = bytearray(map(max, self.__registers, other.__registers))
+
+    def estimate(self):
+        m = self.__m
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        e = alpha * m * m / sum(2.0 ** -r for r in self.__registers)
+        zeros = self.__registers.count(0)
+        if e <= 2.5 * m and zeros:
+            e = m * _math.log(m / zeros)
+        return int(round(e))
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, rate=0.01):
+        """
+
+        :param capacity: The number of values expected
+        :param rate: The false positive rate when `capacity` values are added
+        """
+        if capacity <= 0 or not 0 < rate < 1:
+            raise ValueError
+        self.__m = int(_math.ceil(-capacity * _math.log(rate) / _math.log(2) ** 2))
+        self.__k = max(1, int(round(self.__m / capacity * _math.log(2))))
+        self.__bits = bytearray((self.__m + 7) // 8)
+
+    def __len__(self):
+        return len(self.__bits)
+
+    def add(self, digest):
+        """
+        Add a 16-byte digest (see `digest`).
+
+        :return: True if the digest was (probably) added before
+        """
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        found = True
+        for i in range(self.__k):
+            j = (h1 + i * h2) % self.__m
+            byte, bit = j >> 3, 1 << (j & 7)
+            if not self.__bits[byte] & bit:
+                found = False
+                self.__bits[byte] |= bit
+        return found
+
+
+def parse_duration(text):
+    """
+    Parse a duration such as "30s", "5m", "1h" or "1d" into seconds.
+
+    A number without a unit is in seconds.
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text and text[-1] in units:
+        return int(text[:-1]) * units[text[-1]]
+    return int(text)
+
+
+class TimeBuckets(object):
+    """
+    Round timestamps in a `strptime` format down to buckets of `width` seconds.
+
+    If the format ends with seconds ("%S"), timestamps are parsed without the seconds,
+    so that all timestamps in the same minute share one parse. Parsed timestamps and
+    formatted buckets are cached.
+    """
+    CACHE_SIZE = 65536
+    EPOCH = _datetime.datetime(1970, 1, 1)
+
+    def __init__(self, fmt, width):
+        if width <= 0:
+            raise ValueError
+        self.__fmt = fmt
+        self.__width = width
+        self.__by_minute = fmt.endswith("%S")
+        self.__parsed = {}
+        self.__buckets = {}
+
+    def __parse(self, text, fmt):
+        if text not in self.__parsed:
+            if len(self.__parsed) >= TimeBuckets.CACHE_SIZE:
+                self.__parsed.clear()
+            dt = _datetime.datetime.strptime(text, fmt)
+            self.__parsed[text] = int((dt - TimeBuckets.EPOCH).total_seconds())
+        return self.__parsed[text]
+
+    def __call__(self, value):
+        value = str(value)
+        if self.__by_minute and value[-2:].isdigit():
+            t = self.__parse(value[:-2], self.__fmt[:-2]) + int(value[-2:])
+        else:
+            t = self.__parse(value, self.__fmt)
+        start = t - t % self.__width
+        if start not in self.__buckets:
+            if len(self.__buckets) >= TimeBuckets.CACHE_SIZE:
+                self.__buckets.clear()
+            dt = TimeBuckets.EPOCH + _datetime.timedelta(seconds=start)
+            self.__buckets[start] = dt.strftime(self.__fmt)
+        return self.__buckets[start]
+
+
+class Progress(object):
+    """
+    A progress line of reading `size` bytes, redrawn on `file` at most once every `interval` seconds.
+    """
+
+    def __init__(self, size, file=None, interval=0.5):
+        self.__size = size
+        self.__file = file if file is not None else _sys.stderr
+        self.__interval = interval
+        self.__start = self.__last = _time.perf_counter()
+        self.__shown = False
+
+    def update(self, done, rows):
+        """
+        Redraw the line if `interval` has passed since it was last drawn.
+
+        :param done: Bytes read so far
+        :param rows: Rows read so far
+        """
+        now = _time.perf_counter()
+        if now - self.__last < self.__interval:
+            return
+        self.__last = now
+        elapsed = now - self.__start
+        done = min(done, self.__size)
+        rate = done / elapsed
+        if rate > 0:
+            eta = str(_datetime.timedelta(seconds=int((self.__size - done) / rate)))
+        else:
+            eta = "-"
+        self.__file.write("\r{:5.1f}%  {:.1f} MB/s  {:.0f} rows/s  ETA {}\033[K".format(
+            done / self.__size * 100 if self.__size else 100.0,
+            rate / 1024 / 1024,
+            rows / elapsed,
+            eta
+        ))
+        self.__file.flush()
+        self.__shown = True
+
+    def clear(self):
+        """
+        Erase the line, if it has been drawn.
+        """
+        if self.__shown:
+            self.__file.write("\r\033[K")
+            self.__file.flush()
+            self.__shown = False
+
+
+class Interrupt(object):
+    """
+    Within a `with` block, turn Ctrl-C into a request to stop, which readers check between rows.
+
+    Pressing Ctrl-C again before the request is handled raises `KeyboardInterrupt` as usual.
+    Ctrl-C is left alone outside the main thread.
+    """
+
+    def __init__(self):
+        self.requested = False
+        self.rows = None
+        self.__previous = None
+
+    def __handle(self, signum, frame):
+        if self.requested:
+            raise KeyboardInterrupt
+        self.requested = True
+
+    def __enter__(self):
+        self.requested = False
+        self.rows = None
+        if _threading.current_thread() is _threading.main_thread():
+            self.__previous = _signal.signal(_signal.SIGINT, self.__handle)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.__previous is not None:
+            _signal.signal(_signal.SIGINT, self.__previous)
+            self.__previous = None